@@ -1,12 +1,42 @@
+import json
+import os
 import os.path
+import pickle
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 from xml.etree import ElementTree
 
-import pickle
 import requests
 import sys
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as TransportError
+from urllib3.util.retry import Retry
+
+from instrumentation import metrics
+from shard_store import ShardStore
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+ARXIV = '{http://arxiv.org/schemas/atom}'
+
+# Fields every stored record needs, entries missing one of them are skipped
+REQUIRED_FIELDS = ('id', 'url', 'title', 'sum', 'cat_sub')
+
+# Id of the entry the API sends back instead of results (ex: malformed query)
+ERROR_ID = 'http://arxiv.org/api/errors'
+
+# Entries sorted by submission date, oldest first: new papers are appended, so offsets stay valid between runs
+SORT_ORDER = '&sortBy=submittedDate&sortOrder=ascending'
+
+# Number of entries per page of the first harvester, which stored them as <primary category>_<start>.p
+LEGACY_PAGE_SIZE = 1000
 
-sys.setrecursionlimit(1000000)
+
+class FeedError(ValueError):
+    """The API answered with an error entry instead of results"""
 
 
 def get_entries(xml_root, cat_main):
@@ -38,15 +68,396 @@ def get_entries(xml_root, cat_main):
     return entries
 
 
+def iter_entries(stream, cat_main, skipped=None):
+    """Parse entries incrementally from a file-like object
+
+    Entries are yielded as soon as their closing tag has been read and are then
+    removed from the tree, so memory stays flat whatever the page size.
+    Entries missing one of REQUIRED_FIELDS are skipped and counted as
+    'bad_entries'.
+
+    Arguments:
+        stream {object}     -- file-like object (ex: response.raw)
+        cat_main {text}     -- primary category name
+
+    Keyword Arguments:
+        skipped {list}      -- filled with the fields found in the skipped entries (default: {None})
+
+    Raises:
+        FeedError -- the feed is an arXiv error message
+
+    Returns:
+        [generator] -- Entry - same dict as get_entries
+    """
+
+    root = None
+    for event, elem in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+
+        if elem.tag != ATOM + 'entry':
+            continue
+
+        record = {'cat_main': cat_main}
+        for child in elem:
+            text = child.text or ''
+            if child.tag == ATOM + 'id':
+                record['url'] = text
+                record['id'] = text.replace('http://arxiv.org/abs/', '')
+            elif child.tag == ATOM + 'title':
+                record['title'] = text
+            elif child.tag == ATOM + 'summary':
+                record['sum'] = text.replace('\n', ' ')
+            elif child.tag == ARXIV + 'primary_category':
+                record['cat_sub'] = child.attrib.get('term')
+
+        # Drop the parsed entry (and anything before it) from the tree
+        root.clear()
+        if record.get('url', '').startswith(ERROR_ID):
+            raise FeedError(record.get('sum') or record['url'])
+        if any(not record.get(field) for field in REQUIRED_FIELDS):
+            metrics.count('bad_entries')
+            if skipped is not None:
+                skipped.append(record)
+            continue
+        yield record
+
+
+class RateLimiter(object):
+    """Enforce a minimum delay between two requests sent to the same host.
+
+    Shared by every worker thread so that running categories concurrently
+    does not multiply the load put on the arXiv API.
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        """Block until a request to the url's host is allowed
+
+        Arguments:
+            url {text} -- url about to be requested
+        """
+
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, url, delay):
+        """Hold back every request to the url's host for some time (ex: after a 503)
+
+        Arguments:
+            url {text}      -- url that failed
+            delay {float}   -- seconds before the next request to its host
+        """
+
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot[host] = max(self._next_slot.get(host, now), now + delay)
+
+
+class Manifest(object):
+    """Per-category cursor stored as JSON next to the raw files.
+
+    Each query key maps to {"start": next offset to fetch, "done": bool}. The
+    file is rewritten atomically after every page so that a crash resumes at
+    the last stored page.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.cursors = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.cursors = json.load(f)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.cursors
+
+    def get(self, key):
+        with self._lock:
+            return dict(self.cursors.get(key, {'start': 0, 'done': False}))
+
+    def update(self, key, start, done):
+        with self._lock:
+            self.cursors[key] = {'start': start, 'done': done}
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                json.dump(self.cursors, f, indent=2, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+
+
+def create_session(pool_size):
+    """Create a requests session whose connection pool is shared by all workers
+
+    Arguments:
+        pool_size {int} -- number of pooled connections per host
+
+    Returns:
+        [Session] -- http session
+    """
+
+    session = requests.Session()
+    # Connection errors only, error statuses are retried by harvest_category with a backoff
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=Retry(3, respect_retry_after_header=False))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_retry_after(response):
+    """Delay asked by the Retry-After header of a response
+
+    Arguments:
+        response {Response} -- http response, or None
+
+    Returns:
+        [float] -- seconds, None without a valid header
+    """
+
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def get_shard_name(key, val, start):
+    """Build the name of the shard storing one page of a query
+
+    Arguments:
+        key {text}      -- arXiv query category (ex: cs*)
+        val {text}      -- primary category name
+        start {int}     -- offset of the page
+
+    Returns:
+        [text] -- shard name
+    """
+
+    return val.lower().replace(' ', '_') + '_' + key.rstrip('*') + '_' + str(start)
+
+
+def get_legacy_offset(store, raw_path, val):
+    """Offset following the pages stored by the first harvester for a primary category
+
+    Those pages are named <primary category>_<start>, as pickles in raw_path
+    or as shards once 2_create_dataset.py imported them. They are followed
+    from offset 0 and up to the first partial page.
+
+    Arguments:
+        store {ShardStore}  -- raw records store
+        raw_path {text}     -- raw shard store folder
+        val {text}          -- primary category name
+
+    Returns:
+        [int] -- offset following the last page found, 0 if there is none
+    """
+
+    start = 0
+    while True:
+        name = val.lower().replace(' ', '_') + '_' + str(start)
+        filename = os.path.join(raw_path, name + '.p')
+        if name in store:
+            nb_entries = len(store.shard(name))
+        elif os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                nb_entries = len(pickle.load(f))
+        else:
+            return start
+        start += nb_entries
+        if nb_entries < LEGACY_PAGE_SIZE:
+            return start
+
+
+def seed_manifest(manifest, store, raw_path, categories):
+    """Start the queries that have no cursor after the pages of the first harvester
+
+    The first harvester named its pages after the primary category only, so
+    they are given to the first query of each category; the pages of the
+    other queries of a shared category (ex: Physics) cannot be told apart and
+    are fetched again, the dataset build drops the duplicates.
+
+    Arguments:
+        manifest {Manifest}     -- per-category cursors, updated in place
+        store {ShardStore}      -- raw records store
+        raw_path {text}         -- raw shard store folder
+        categories {dict}       -- arXiv query category -> primary category name
+    """
+
+    seen = set()
+    for key, val in categories.items():
+        if val in seen:
+            continue
+        seen.add(val)
+        if key not in manifest:
+            start = get_legacy_offset(store, raw_path, val)
+            if start:
+                print(key + ': resuming after the %d entries of the previous harvester' % start)
+                manifest.update(key, start, False)
+
+
+def harvest_category(session, limiter, manifest, store, key, val, base_url, max_results, timeout, retries,
+                     backoff, refresh):
+    """Fetch every page of a query, starting from the cursor stored in the manifest
+
+    Arguments:
+        session {Session}       -- pooled http session
+        limiter {RateLimiter}   -- per-host rate limiter
+        manifest {Manifest}     -- per-category cursors
+        store {ShardStore}      -- raw records store
+        key {text}              -- arXiv query category (ex: cs*)
+        val {text}              -- primary category name
+        base_url {text}         -- arXiv API query url
+        max_results {int}       -- number of entries per page
+        timeout {float}         -- http timeout in seconds
+        retries {int}           -- number of attempts per page
+        backoff {float}         -- seconds before the second attempt, doubled on each attempt, unless the
+                                   server sends Retry-After
+        refresh {bool}          -- fetch the entries submitted after the end of a finished query
+
+    Returns:
+        [int] -- number of entries stored during this run
+    """
+
+    cursor = manifest.get(key)
+    if refresh:
+        cursor['done'] = False
+    start = cursor['start']
+    nb_entries = 0
+
+    while not cursor['done']:
+        url = base_url + '?search_query=cat:' + str(key) + SORT_ORDER + '&start=' + str(start) + \
+              '&max_results=' + str(max_results)
+
+        for attempt in range(retries):
+            with metrics.stage('rate_limit'):
+                limiter.wait(url)
+            print(url)
+            try:
+                # Parsing consumes the response stream, both are timed together
+                with metrics.stage('fetch'), session.get(url, timeout=timeout, stream=True) as data:
+                    data.raise_for_status()
+                    data.raw.decode_content = True
+                    skipped = []
+                    entries = list(iter_entries(data.raw, val, skipped))
+                    metrics.count('bytes_read', data.raw.tell())
+                break
+            except (requests.RequestException, TransportError, ElementTree.ParseError, FeedError) as e:
+                metrics.count('fetch_errors')
+                print(sys.exc_info())
+                # The whole host is held back, so the other workers do not hammer it either
+                retry_after = get_retry_after(getattr(e, 'response', None))
+                limiter.defer(url, backoff * 2 ** attempt if retry_after is None else retry_after)
+        else:
+            print("giving up on " + key + " at " + str(start))
+            return nb_entries
+
+        print(key + ': ' + str(len(entries)) + (' (%d malformed, skipped)' % len(skipped) if skipped else ''))
+        metrics.count('pages')
+        metrics.count('entries', len(entries))
+        if entries:
+            # A page fetched again (ex: cursor saved before its shard) replaces its shard
+            with metrics.stage('store'):
+                store.append(get_shard_name(key, val, start), entries, replace=True)
+            nb_entries += len(entries)
+        # The next page starts after the entries received, a partial page is completed by the next run
+        start = start + len(entries) + len(skipped)
+
+        # Only an empty page ends the query, a page of malformed entries does not
+        cursor['done'] = len(entries) + len(skipped) == 0
+        manifest.update(key, start, cursor['done'])
+
+    return nb_entries
+
+
+def harvest(categories, base_url, raw_path, max_results=1000, n_workers=4, min_interval=3.0, timeout=60,
+            retries=3, backoff=5.0, refresh=False):
+    """Fetch all categories concurrently, resuming from the manifest in raw_path
+
+    Queries without a cursor start after the pages of the first harvester
+    (see seed_manifest). With refresh, finished queries fetch the entries
+    submitted since their last page.
+
+    Arguments:
+        categories {dict}   -- arXiv query category -> primary category name
+        base_url {text}     -- arXiv API query url
+        raw_path {text}     -- raw shard store folder
+
+    Keyword Arguments:
+        max_results {int}       -- number of entries per page (default: {1000})
+        n_workers {int}         -- number of categories fetched at the same time, 1: in the calling thread
+                                   (default: {4})
+        min_interval {float}    -- minimum delay in seconds between two requests to a host (default: {3.0})
+        timeout {float}         -- http timeout in seconds (default: {60})
+        retries {int}           -- number of attempts per page (default: {3})
+        backoff {float}         -- seconds before retrying a page, doubled on each attempt, unless the server
+                                   sends Retry-After (default: {5.0})
+        refresh {bool}          -- fetch new entries of finished queries (default: {False})
+
+    Returns:
+        [dict] -- number of entries stored per category
+    """
+
+    store = ShardStore(raw_path)
+    manifest = Manifest(os.path.join(raw_path, 'manifest.json'))
+    seed_manifest(manifest, store, raw_path, categories)
+    limiter = RateLimiter(min_interval)
+    session = create_session(n_workers)
+
+    results = {}
+    if n_workers == 1:
+        # Categories one after the other in the calling thread, which metrics can profile
+        for key, val in categories.items():
+            results[key] = harvest_category(session, limiter, manifest, store, key, val, base_url, max_results,
+                                            timeout, retries, backoff, refresh)
+        return results
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(harvest_category, session, limiter, manifest, store, key, val, base_url,
+                                   max_results, timeout, retries, backoff, refresh): key
+                   for key, val in categories.items()}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
 if __name__ == '__main__':
 
     # -------------------------------------------------------------------------
     # PARAMETERS
     # -------------------------------------------------------------------------
 
-    start = 0
-    max_results = 1000
-    models_path = './files/models/'
+    max_results = 1000  # pages are parsed as a stream, larger pages do not grow memory
+    raw_path = './files/raw/'
+    base_url = 'http://export.arxiv.org/api/query'  # point to a local server to replay canned Atom pages
+    n_workers = 4
+    min_interval = 3.0  # arXiv asks for 3 seconds between calls
+    backoff = 5.0  # seconds before retrying a failed page, doubled on each attempt, Retry-After if sent
+    refresh = False  # True: fetch the entries submitted since the last page of finished queries
+    metrics_filename = './files/metrics/get_data_arxiv.json'  # .prom for Prometheus text, None: not written
+    # Stages run under cProfile (ex: ('harvest',)). Only the main thread is profiled: set n_workers = 1 so that
+    # the categories are fetched in it, worker threads are not profiled.
+    profile_stages = ()
 
     CATEGORIES = OrderedDict([
         ("cs*", "Computer Science"),
@@ -75,36 +486,12 @@ if __name__ == '__main__':
     # ARXIV QUERIES
     # -------------------------------------------------------------------------
 
-    for key, val in CATEGORIES.items():
-
-        # True until query return results
-        more_data = True
-
-        while more_data:
-            url = 'http://export.arxiv.org/api/query?search_query=cat:' + \
-                  str(key) + '&start=' + str(start) + '&max_results=' + str(max_results)
-
-            filename = './files/raw/' + val.lower().replace(' ', '_') + '_' + str(start) + '.p'
-
-            if not os.path.exists(filename):
-
-                print(url)
-                data = requests.get(url, timeout=None)
-                try:
-
-                    root = ElementTree.fromstring(data.content)
-                    entries = get_entries(root, val)
-
-                    print(len(entries))
-                    more_data = True if len(entries) > 0 else False
-                    start = (start + max_results) if len(entries) > 0 else 0
-
-                    # Store in Pickle
-                    if start != 0:
-                        pickle.dump(entries, open(models_path + filename, "wb"))
-                except:
-                    print(sys.exc_info())
-                    pass
-            else:
-                print("file already exist")
-                start = start + max_results
+    metrics.configure(profile_stages)
+    t0 = time.time()
+    with metrics.stage('harvest'):
+        results = harvest(CATEGORIES, base_url, raw_path, max_results=max_results, n_workers=n_workers,
+                          min_interval=min_interval, backoff=backoff, refresh=refresh)
+    for key, nb_entries in results.items():
+        print(key + ' : ' + str(nb_entries) + ' new entries')
+    print("done in %0.3fs" % (time.time() - t0))
+    metrics.write(metrics_filename)
@@ -1,96 +1,456 @@
+import hashlib
+import json
 import os
 import pickle
-import string
 import sys
+import time
+from itertools import tee
 
-from nltk import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+from dedup import DedupIndex, normalize_id
+from instrumentation import metrics
+from preprocessing import TextCleaner, clean_texts, save_lemma_table
+from shard_store import PROCESSED_COLUMNS, ChunkWriter, ShardStore
 
 
-def clean_text(text):
-    """Clean raw text using different methods :
-       1. tokenize text
-       2. lower text
-       3. remove punctuation
-       4. remove non-alphabetics char
-       5. remove stopwords
-       6. lemmatize
-    
+def get_files_from_path(path):
+    """return legacy pickle files from folder
+
     Arguments:
-        text {string} -- raw text
+        path {string} -- folder path
     
     Returns:
-        [string] -- clean text
+        [array] -- array of file's name
     """
 
-    # split into words
-    tokens = word_tokenize(text)
-    # convert to lower case
-    tokens = [w.lower() for w in tokens]
-    # remove punctuation from each word
-    table = str.maketrans('', '', string.punctuation)
-    stripped = [w.translate(table) for w in tokens]
-    # remove remaining tokens that are not alphabetic
-    words = [word for word in stripped if word.isalpha()]
-    # filter out stop words
-    stop_words = set(stopwords.words('english'))
-    words = [w for w in words if not w in stop_words]
+    files = []
+    for file in os.listdir(path):
+        # skip the harvester manifest and any other non-pickle file
+        if file.endswith(".p"):
+            files.append(os.path.join(path, file))
+    return files
+
 
-    stemmed = [wordnet.lemmatize(word) for word in words]
+def import_legacy_dataset(filename, dataset, chunk_size):
+    """Copy a dataset pickled as one list by older versions into the chunked store
 
-    return ' '.join(stemmed)
+    Arguments:
+        filename {string}       -- legacy dataset pickle
+        dataset {ShardStore}    -- processed records store
+        chunk_size {int}        -- number of records per chunk
+    """
 
+    with ChunkWriter(dataset, chunk_size=chunk_size) as writer:
+        for record in pickle.load(open(filename, "rb")):
+            writer.write(record)
 
-def get_files_from_path(path):
-    """return files from folder
+
+def get_file_hash(filename):
+    """SHA-256 of a file's content
 
     Arguments:
-        path {string} -- folder path
-    
+        filename {string} -- file path
+
     Returns:
-        [array] -- array of file's name
+        [string] -- hex digest
     """
 
-    files = []
-    for file in os.listdir(path):
-        # if file.endswith(".p") and "cs." in file: a corriger car physics est pris en compte
-        files.append(os.path.join(path, file))
-    return files
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_build_state(filename):
+    """Load the shards already processed by a previous build
+
+    Arguments:
+        filename {string} -- state file path
+
+    Returns:
+        [dict] -- shard name -> {'hash', 'size', 'mtime_ns', 'ids'} (only the hash for states written by older
+                  versions, no 'ids' before they were recorded)
+    """
+
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)['shards']
+
+
+def save_build_state(filename, shards):
+    """Store the processed shards, atomically
+
+    Arguments:
+        filename {string}   -- state file path
+        shards {dict}       -- shard name -> {'hash', 'size', 'mtime_ns', 'ids'}
+    """
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump({'shards': shards}, f, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+def get_pending_shards(store, processed_shards):
+    """List the shards that are new or whose content changed since the last build
+
+    A shard whose size and modification time are the ones of the last build
+    is not read; the others are hashed. The entries of shards that were only
+    touched (same hash) are refreshed in processed_shards, so they are not
+    hashed again on the next build.
+
+    Arguments:
+        store {ShardStore}          -- raw records store
+        processed_shards {dict}     -- shard name -> state of the last build, see load_build_state
+
+    Returns:
+        [dict] -- shard name -> current state, for pending shards only
+    """
+
+    pending = {}
+    for name in store.names():
+        st = os.stat(store.get_filename(name))
+        state = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        previous = processed_shards.get(name)
+        if isinstance(previous, dict) and previous.get('size') == st.st_size and \
+                previous.get('mtime_ns') == st.st_mtime_ns:
+            continue
+
+        metrics.count('shards_hashed')
+        state['hash'] = get_file_hash(store.get_filename(name))
+        previous_hash = previous.get('hash') if isinstance(previous, dict) else previous
+        if previous_hash == state['hash']:
+            if isinstance(previous, dict) and 'ids' in previous:
+                state['ids'] = previous['ids']
+            processed_shards[name] = state
+        else:
+            pending[name] = state
+    return pending
+
+
+def get_stored_ids(store, name, state, dataset):
+    """arXiv ids a raw shard added to the dataset during the previous builds
+
+    States written before the ids were recorded only give the current records
+    of the shard: the stored records with the same id (version included) and
+    main category are taken as its own. Records since removed from the shard
+    are not found this way, a full rebuild drops them.
+
+    Arguments:
+        store {ShardStore}      -- raw records store
+        name {string}           -- raw shard name
+        state {dict}            -- state of the shard at the last build, see load_build_state
+        dataset {ShardStore}    -- processed records store
+
+    Returns:
+        [set] -- arXiv ids, without version (see dedup.normalize_id)
+    """
+
+    if isinstance(state, dict) and 'ids' in state:
+        return set(state['ids'])
+    own = {(record['id'], record['cat_main']) for record in store.shard(name).records(['id', 'cat_main'])}
+    return {normalize_id(arxiv_id) for arxiv_id, cat_main in zip(dataset.column('id'), dataset.column('cat_main'))
+            if (arxiv_id, cat_main) in own}
+
+
+def remove_records(dataset, ids):
+    """Remove the records of some arXiv ids from the dataset, rewriting only the chunks holding them
+
+    Arguments:
+        dataset {ShardStore}    -- processed records store
+        ids {set}               -- arXiv ids, without version (see dedup.normalize_id)
+
+    Returns:
+        [int] -- number of records removed
+    """
+
+    nb_removed = 0
+    for name, shard in list(dataset.shards()):
+        removed = [normalize_id(arxiv_id) in ids for arxiv_id in shard.column('id')]
+        if not any(removed):
+            continue
+        kept = [record for record, drop in zip(shard.records(), removed) if not drop]
+        if kept:
+            dataset.append(name, kept, replace=True)
+        else:
+            dataset.remove(name)
+        nb_removed += sum(removed)
+    return nb_removed
+
+
+def iter_shard_records(store, names, index, sources=None):
+    """Iterate over the raw records of some shards, skipping ids already seen
+
+    The stored records of changed shards must be removed first (see
+    remove_records), so that their new version is not skipped.
+
+    Arguments:
+        store {ShardStore}  -- raw records store
+        names {list}        -- shard names
+        index {DedupIndex}  -- arXiv ids already seen (any version), updated in place
+
+    Keyword Arguments:
+        sources {dict}      -- filled with the shard name of each yielded id, without version (default: {None})
+
+    Returns:
+        [generator] -- records
+    """
+
+    for name in names:
+        print(name)
+        with metrics.stage('read'):
+            records = store.shard(name).records()
+        metrics.count('bytes_read', os.path.getsize(store.get_filename(name)))
+        metrics.count('records_read', len(records))
+        for record in records:
+            if index.add_id(record['id']):
+                if sources is not None:
+                    sources[normalize_id(record['id'])] = name
+                yield record
+            else:
+                metrics.count('duplicates')
+
+
+def drop_near_duplicates(records, index):
+    """Skip the cleaned records whose input is a near duplicate of an indexed one
+
+    Arguments:
+        records {iterable}  -- cleaned records
+        index {DedupIndex}  -- index of the dataset, updated in place
+
+    Returns:
+        [generator] -- records added to the index
+    """
+
+    for record in records:
+        with metrics.stage('dedup'):
+            duplicate = index.add_text(record['id'], record['input'])
+        if duplicate is None:
+            yield record
+        else:
+            metrics.count('near_duplicates')
+
+
+def index_dataset(index, dataset):
+    """Rebuild the dedup index from the records of the dataset, dropping the duplicates it contains
+
+    Records stored before the index existed (or by an older build) are
+    checked like new ones; the chunks holding duplicates are rewritten
+    without them.
+
+    Arguments:
+        index {DedupIndex}      -- index, cleared first (its drop statistics are kept)
+        dataset {ShardStore}    -- processed records store
+
+    Returns:
+        [tuple] -- number of (duplicate ids, near duplicates) removed from the dataset
+    """
+
+    index.clear()
+    nb_duplicate_ids = nb_near_duplicates = 0
+    for name in dataset.names():
+        shard = dataset.shard(name)
+        kept = []
+        for arxiv_id, text in zip(shard.column('id'), shard.column('input')):
+            if not index.add_id(arxiv_id):
+                nb_duplicate_ids += 1
+                kept.append(False)
+            elif index.add_text(arxiv_id, text) is not None:
+                nb_near_duplicates += 1
+                kept.append(False)
+            else:
+                kept.append(True)
+        if not all(kept):
+            records = [record for record, keep in zip(shard.records(), kept) if keep]
+            if records:
+                dataset.append(name, records, replace=True)
+            else:
+                dataset.remove(name)
+    index.save()
+    metrics.count('duplicates', nb_duplicate_ids)
+    metrics.count('near_duplicates', nb_near_duplicates)
+    return nb_duplicate_ids, nb_near_duplicates
+
+
+def clean_records(records, n_jobs=None, chunksize=500, engine='nltk', lemma_table=None, lemmas=None):
+    """Clean summary and title of each record with a process pool
+
+    Arguments:
+        records {iterable} -- raw records
+
+    Keyword Arguments:
+        n_jobs {int}        -- number of worker processes, all cores if None (default: {None})
+        chunksize {int}     -- number of texts sent to a worker at once (default: {500})
+        engine {text}       -- tokenizer, 'nltk' or 'fast' (default: {'nltk'})
+        lemma_table {text}  -- lemma table of the previous builds (default: {None})
+        lemmas {dict}       -- filled with the lemmas missing from the table (default: {None})
+
+    Returns:
+        [generator] -- cleaned records, in input order
+    """
+
+    records, pending = tee(records)
+    texts = (text for record in records for text in (record['sum'], record['title']))
+    cleaned = clean_texts(texts, n_jobs=n_jobs, chunksize=chunksize, engine=engine, lemma_table=lemma_table,
+                          lemmas=lemmas)
+
+    for record in pending:
+        record['sum'] = next(cleaned)
+        record['title'] = next(cleaned)
+        record['input'] = record['sum'] + ' ' + record['title']
+        record['sum'] = record['sum'].split(';')[0]
+        yield record
+
+
+def build_dataset(store, dataset, index, processed_shards, chunk_size=10000, n_jobs=None, chunksize=500,
+                  engine='nltk', lemma_table=None, lemmas=None):
+    """Add the records of the new and changed raw shards to the dataset
+
+    The records a changed shard added during the previous builds are removed
+    first (see get_stored_ids), then its current records go through the same
+    dedup as the ones of new shards: an id stored by another shard stays
+    with it, and a record removed from the shard leaves the dataset.
+
+    Arguments:
+        store {ShardStore}          -- raw records store
+        dataset {ShardStore}        -- processed records store
+        index {DedupIndex}          -- dedup index of the dataset, saved at the end
+        processed_shards {dict}     -- state of the last build, updated in place with the pending shards
+
+    Keyword Arguments:
+        chunk_size {int}    -- number of records per dataset chunk (default: {10000})
+        n_jobs {int}        -- number of cleaning processes, all cores if None (default: {None})
+        chunksize {int}     -- number of texts sent to a worker at once (default: {500})
+        engine {text}       -- tokenizer, 'nltk' or 'fast' (default: {'nltk'})
+        lemma_table {text}  -- lemma table of the previous builds (default: {None})
+        lemmas {dict}       -- filled with the lemmas missing from the table (default: {None})
+
+    Returns:
+        [int] -- number of records added
+    """
+
+    with metrics.stage('hash'):
+        pending_shards = get_pending_shards(store, processed_shards)
+
+    # Records of changed shards are replaced: the ids they added are removed before the shards are read again,
+    # and the dedup index is rebuilt without them
+    changed_shards = [name for name in pending_shards if name in processed_shards]
+    if changed_shards:
+        changed_ids = set()
+        for name in changed_shards:
+            changed_ids |= get_stored_ids(store, name, processed_shards[name], dataset)
+        with metrics.stage('remove'):
+            nb_removed = remove_records(dataset, changed_ids)
+        metrics.count('records_replaced', nb_removed)
+        print("Changed shards   : %d, %d stored records removed" % (len(changed_shards), nb_removed))
+
+    # The index follows the dataset, rebuilt when a build stopped before saving it or records were removed
+    if changed_shards or len(index) != len(dataset):
+        print("Indexing the %d records of the dataset for dedup" % len(dataset))
+        with metrics.stage('dedup_index'):
+            nb_duplicate_ids, nb_near_duplicates = index_dataset(index, dataset)
+        print("Already stored   : %d duplicate ids, %d near duplicates, removed" % (nb_duplicate_ids,
+                                                                                      nb_near_duplicates))
+    stats = dict(index.stats)
+
+    print("Number of shards : " + str(len(store.names())))
+    print("Pending shards   : " + str(len(pending_shards)))
+
+    # Open each new or changed shard, clean it and append the records by chunks
+    nb_new_records = 0
+    sources = {}
+    for state in pending_shards.values():
+        state['ids'] = []
+    t0 = time.time()
+    with metrics.stage('build'), ChunkWriter(dataset, chunk_size=chunk_size) as writer:
+        records = clean_records(iter_shard_records(store, list(pending_shards), index, sources), n_jobs=n_jobs,
+                                chunksize=chunksize, engine=engine, lemma_table=lemma_table, lemmas=lemmas)
+        for record in drop_near_duplicates(records, index):
+            writer.write(record)
+            arxiv_id = normalize_id(record['id'])
+            pending_shards[sources.pop(arxiv_id)]['ids'].append(arxiv_id)
+            nb_new_records += 1
+    metrics.count('records_written', nb_new_records)
+
+    elapsed = time.time() - t0
+    print("Cleaned %d records in %0.3fs (%0.1f records/s)" % (nb_new_records, elapsed,
+                                                              nb_new_records / max(elapsed, 1e-9)))
+
+    index.save()
+    print("Dropped          : %d duplicate ids, %d near duplicates (%d / %d since the first build)" % (
+        index.stats['duplicate_ids'] - stats['duplicate_ids'], index.stats['near_duplicates'] -
+        stats['near_duplicates'], index.stats['duplicate_ids'], index.stats['near_duplicates']))
+
+    # Mark the shards as processed once their records are stored
+    processed_shards.update(pending_shards)
+    return nb_new_records
 
 
 if __name__ == '__main__':
 
     # Output folder
     path = './files/raw/'
+    dataset_path = './files/processed/dataset/'
+    legacy_dataset_filename = './files/processed/dataset.p'
+    state_filename = './files/processed/build_state.json'
+    lemma_table_filename = './files/processed/lemmas.json'  # token -> lemma of the corpus, used for inference
+    dedup_path = './files/processed/dedup/'  # ids and MinHash signatures of the dataset records
+    near_duplicate_threshold = 0.8  # estimated Jaccard similarity of the word 3-grams, above: dropped
+
+    incremental = True  # False: rebuild the dataset from every shard
+    n_jobs = None  # None: one worker per core
+    chunksize = 500
+    engine = 'nltk'  # fast: single regex tokenizer, rebuild the dataset (incremental = False) when changing it
+    dataset_chunk_size = 10000  # records per dataset chunk, bounds the memory of readers
+    metrics_filename = './files/metrics/create_dataset.json'  # .prom for Prometheus text, None: not written
+    profile_stages = ()  # stages run under cProfile (ex: ('build',)), the cleaning workers are not profiled
+
+    metrics.configure(profile_stages)
+
+    store = ShardStore(path)
+    dataset = ShardStore(dataset_path, columns=PROCESSED_COLUMNS)
+
+    # Convert per-page pickles written by older versions of the harvester
+    for file in get_files_from_path(path):
+        name = os.path.splitext(os.path.basename(file))[0]
+        if name not in store:
+            try:
+                store.import_pickle(file)
+            except:
+                print(sys.exc_info())
+                print("Error with file : " + file)
+
+    processed_shards = {}
+    if incremental:
+        if len(dataset) == 0 and os.path.exists(legacy_dataset_filename):
+            import_legacy_dataset(legacy_dataset_filename, dataset, dataset_chunk_size)
+        processed_shards = load_build_state(state_filename)
+    else:
+        dataset.clear()
+
+    # One engine per dataset, recorded with it and then in the models trained on it (unknown for older datasets)
+    dataset_engine = dataset.meta.get('engine')
+    if len(dataset) and dataset_engine not in (None, engine):
+        raise ValueError("the dataset was cleaned with engine %r, set incremental = False to rebuild it with %r" % (
+            dataset_engine, engine))
+    if not len(dataset):
+        dataset.set_meta(engine=engine)
+
+    # Clean the records of the new and changed shards and append them by chunks
+    print("Folder name      : " + path)
+    lemma_table = lemma_table_filename if os.path.exists(lemma_table_filename) else None
+    new_lemmas = {}
+    index = DedupIndex(dedup_path, threshold=near_duplicate_threshold)
+    build_dataset(store, dataset, index, processed_shards, chunk_size=dataset_chunk_size, n_jobs=n_jobs,
+                  chunksize=chunksize, engine=engine, lemma_table=lemma_table, lemmas=new_lemmas)
+
+    # Add the tokens of the new records to the lemma table
+    cleaner = TextCleaner(lemma_table=lemma_table)
+    cleaner.lemmas.update(new_lemmas)
+    save_lemma_table(lemma_table_filename, cleaner.lemmas, cleaner.stop_words)
+    print("Lemma table      : %d tokens (%d new)" % (len(cleaner.lemmas), len(new_lemmas)))
 
-    files_path = get_files_from_path(path)
-    wordnet = WordNetLemmatizer()
-
-    print("Folder name     : " + path)
-    print("Number of files : " + str(len(files_path)))
-
-    # Store dataset
-    fulldataset = []
-
-    # Open each pickle and start pre-processing
-    for file in files_path:
-        try:
-            with open(file, "rb") as f:
-                data = pickle.load(f)
-                print(file)
-
-                for record in data:
-                    record['sum'] = clean_text(record['sum'])
-                    record['title'] = clean_text(record['title'])
-                    record['input'] = record['sum'] + ' ' + record['title']
-                    record['sum'] = record['sum'].split(';')[0]
-                    fulldataset.append(record)
-        except:
-            print(sys.exc_info())
-            print("Error with file : " + file)
-            pass
-
-    # Store in Pickle
-    pickle.dump(fulldataset, open('dataset.p', "wb"))
-    print("File contains " + str(len(fulldataset)) + " records")
+    save_build_state(state_filename, processed_shards)
+    print("Dataset contains " + str(len(dataset)) + " records")
+    metrics.write(metrics_filename)
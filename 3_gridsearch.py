@@ -1,19 +1,25 @@
 import logging
-import pickle
 import time
+from collections import OrderedDict
 from pprint import pprint
 
 import numpy as np
 import pandas as pd
 from sklearn import model_selection, preprocessing
+from sklearn.base import clone
 from sklearn.externals import joblib
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 from sklearn.feature_selection import (SelectKBest, chi2, f_classif, f_regression)
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.model_selection import ParameterSampler, StratifiedKFold
 from sklearn.pipeline import Pipeline
 
+from feature_store import FeatureStore, subset_fingerprint, texts_fingerprint
+from instrumentation import metrics
+from model_registry import ModelRegistry
+from shard_store import PROCESSED_COLUMNS, ShardStore
+
 # Display progress logs on stdout
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(levelname)s %(message)s')
@@ -33,54 +39,347 @@ def encode_data(d, catname):
     return list(le.classes_), le.transform(d[catname])
 
 
-def open_dataset(filename, catname, nb_element_per_cat, sub_cat_filter=None):
+def iter_dataset(path, columns=None):
+    """Read the processed dataset chunk by chunk
+
+    Arguments:
+        path {text}     -- processed dataset folder
+
+    Keyword Arguments:
+        columns {list}  -- columns to read, all of them if None (default: {None})
+
+    Returns:
+        [generator] -- one DataFrame per chunk
+    """
+
+    for chunk in ShardStore(path, columns=PROCESSED_COLUMNS).iter_chunks(columns):
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def stratified_sample(codes, categories, nb_element_per_cat, sub_cat_filter=None, seed=None):
+    """Pick the same number of rows at random in every category
+
+    Rows are grouped once with a stable argsort of the codes, then each
+    category is sampled from its contiguous block of row numbers.
+
+    Arguments:
+        codes {array}               -- category code of every row
+        categories {list}           -- category name of every code
+        nb_element_per_cat {int}    -- number of rows per category. Smaller categories are dropped
+
+    Keyword Arguments:
+        sub_cat_filter {text}   -- keep only categories starting with this prefix (default: {None})
+        seed {int}              -- random seed (default: {None})
+
+    Returns:
+        [array] -- sorted row numbers
+    """
+
+    rng = np.random.RandomState(seed)
+    counts = np.bincount(codes, minlength=len(categories))
+    order = np.argsort(codes, kind='mergesort')
+    ends = np.cumsum(counts)
+
+    selected = []
+    for code in np.argsort(-counts, kind='mergesort'):
+        cat = categories[code]
+        print("category : " + cat + ' has: ' + str(counts[code]))
+
+        # If no filter -> get all categories
+        if counts[code] >= nb_element_per_cat and (not sub_cat_filter or cat.startswith(sub_cat_filter)):
+            rows = order[ends[code] - counts[code]:ends[code]]
+            selected.append(rng.choice(rows, nb_element_per_cat, replace=False))
+
+    print("Total data: " + str(len(codes)))
+    return np.sort(np.concatenate(selected)) if selected else np.zeros(0, dtype=np.int64)
+
+
+@metrics.timed('sample')
+def open_dataset(path, catname, nb_element_per_cat, sub_cat_filter=None, seed=None,
+                 columns=('id', 'input', 'cat_main', 'cat_sub')):
     """Open dataset and filter by category and sub-category
 
+    Only the category column is read to draw the sample, the other columns are
+    decoded for the selected rows only.
+
     Arguments:
-        filename {text}             -- pipeline
+        path {text}                 -- processed dataset folder
         cat_name {text}             -- primary category name
         nb_element_per_cat {text}   -- number of element per category. Choose randomly
         sub_cat_filter {text}       -- name of the sub category
+        seed {int}                  -- random seed of the sample
+        columns {tuple}             -- columns to load
     Returns:
         [DataFrame] -- data
     """
 
-    # Open dataset
-    d = pickle.load(open(filename, "rb"))
-    d = pd.DataFrame(d)
+    store = ShardStore(path, columns=PROCESSED_COLUMNS)
+    codes, categories = store.category_codes(catname)
+    rows = stratified_sample(codes, categories, nb_element_per_cat, sub_cat_filter=sub_cat_filter, seed=seed)
+    metrics.count('rows_sampled', len(rows))
+    return pd.DataFrame(store.take(rows, list(columns)), columns=list(columns))
 
-    df = pd.DataFrame(columns=d.columns)
-    for cat in d[catname].value_counts().index:
 
-        print("category : " + cat + ' has: ' + str(d[catname].value_counts()[cat]))
+def split_params(params, step='vect'):
+    """Split candidate parameters between the first step and the rest of a pipeline
 
-        # If no filter -> get all categories
-        if not sub_cat_filter:
-            if d[catname].value_counts()[cat] >= nb_element_per_cat:
-                cat1 = d[(d[catname] == cat)].sample(n=nb_element_per_cat)
-                df = pd.concat([df, cat1], axis=0)
-        else:
-            # Get specific categories with filter
-            if cat.startswith(sub_cat_filter) and d[catname].value_counts()[cat] >= nb_element_per_cat:
-                cat1 = d[(d.cat == cat)].sample(n=nb_element_per_cat)
-                df = pd.concat([df, cat1], axis=0)
+    Arguments:
+        params {dict}   -- pipeline parameters (ex: {'vect__max_df': 0.8, 'SGD__alpha': 0.001})
 
-    print("Total data: " + str(len(d)))
-    return df
+    Keyword Arguments:
+        step {text}     -- name of the first step (default: {'vect'})
 
+    Returns:
+        [tuple] -- (first step parameters without prefix, other parameters)
+    """
 
-def perform_grid_search(pipeline, data_in, data_out, catname, models_path):
-    """Gridsearch for Pipeline
+    prefix = step + '__'
+    step_params = {k[len(prefix):]: v for k, v in params.items() if k.startswith(prefix)}
+    other_params = {k: v for k, v in params.items() if not k.startswith(prefix)}
+    return step_params, other_params
+
+
+def clamp_k(pipeline, params, nb_features):
+    """Lower the k of the SelectKBest steps to the number of features
+
+    A small fold (ex: the first rounds of successive_halving) can have a
+    vocabulary smaller than kbest__k, in which case every feature is kept.
 
     Arguments:
-        pipeline {object}   -- pipeline
+        pipeline {object}   -- pipeline, without the vectorizer
+        params {dict}       -- parameters of its steps
+        nb_features {int}   -- number of columns of the count matrix
+
+    Returns:
+        [dict] -- parameters
+    """
+
+    params = dict(params)
+    for name, step in pipeline.steps:
+        k = params.get(name + '__k', getattr(step, 'k', None))
+        if isinstance(step, SelectKBest) and k != 'all' and k > nb_features:
+            params[name + '__k'] = nb_features
+    return params
+
+
+def score_vect_group(pipeline, vect_params, group, data_in, data_out, train, test, features=None,
+                     fingerprint=None):
+    """Score every candidate sharing the same vectorizer parameters on one fold
+
+    The vectorizer is fitted once on the training fold and its count matrices
+    are reused by the tfidf/kbest/SGD stages of each candidate. With a feature
+    store, the matrices of a previous run are loaded instead.
+
+    Arguments:
+        pipeline {object}   -- pipeline, its first step is the vectorizer
+        vect_params {dict}  -- vectorizer parameters shared by the group
+        group {list}        -- parameters of the other steps, one dict per candidate
+        data_in {list}      -- dataset text input
+        data_out {array}    -- dataset category output
+        train {array}       -- training rows of the fold
+        test {array}        -- test rows of the fold
+
+    Keyword Arguments:
+        features {object}   -- FeatureStore caching the count matrices (default: {None})
+        fingerprint {text}  -- texts_fingerprint(data_in) (default: {None})
+
+    Returns:
+        [list] -- accuracy of each candidate, nan if its fit failed
+    """
+
+    vect = clone(pipeline.steps[0][1]).set_params(**vect_params)
+    if features is not None:
+        X_train, X_test = features.vectorize(vect, data_in, train, test, fingerprint=fingerprint,
+                                             restore_vocabulary=False)
+    else:
+        X_train = vect.fit_transform([data_in[i] for i in train])
+        X_test = vect.transform([data_in[i] for i in test])
+    rest = Pipeline(pipeline.steps[1:])
+
+    scores = []
+    for params in group:
+        estimator = clone(rest).set_params(**clamp_k(rest, params, X_train.shape[1]))
+        try:
+            estimator.fit(X_train, data_out[train])
+            scores.append(estimator.score(X_test, data_out[test]))
+        except ValueError as e:
+            print("candidate failed: %r %s" % (params, e))
+            scores.append(np.nan)
+    return scores
+
+
+def evaluate_candidates(pipeline, candidates, data_in, data_out, cv=3, n_jobs=4, verbose=5, features=None,
+                        fingerprint=None):
+    """Cross-validate candidates, fitting the vectorizer once per (fold, vect parameters)
+
+    Candidates are grouped by their vect__* parameters; one job per group and
+    fold builds the count matrices and scores the whole group on them.
+
+    Arguments:
+        pipeline {object}   -- pipeline, its first step is the vectorizer
+        candidates {list}   -- pipeline parameters, one dict per candidate
+        data_in {list}      -- dataset text input
+        data_out {list}     -- dataset category output
+
+    Keyword Arguments:
+        cv {int}            -- number of stratified folds (default: {3})
+        n_jobs {int}        -- number of parallel jobs (default: {4})
+        verbose {int}       -- joblib verbosity (default: {5})
+        features {object}   -- FeatureStore caching the count matrices (default: {None})
+        fingerprint {text}  -- texts_fingerprint(data_in), computed if None (default: {None})
+
+    Returns:
+        [array] -- mean accuracy of each candidate
+    """
+
+    data_out = np.asarray(data_out)
+    vect_name = pipeline.steps[0][0]
+
+    groups = OrderedDict()
+    for i, params in enumerate(candidates):
+        vect_params, other_params = split_params(params, vect_name)
+        key = repr(sorted(vect_params.items()))
+        groups.setdefault(key, (vect_params, [], []))
+        groups[key][1].append(i)
+        groups[key][2].append(other_params)
+
+    folds = list(StratifiedKFold(n_splits=cv).split(np.zeros(len(data_out)), data_out))
+    print("%d candidates, %d vectorizer settings, %d folds" % (len(candidates), len(groups), len(folds)))
+    if features is not None and fingerprint is None:
+        fingerprint = texts_fingerprint(data_in)
+
+    jobs = [(vect_params, indices, group, k)
+            for vect_params, indices, group in groups.values()
+            for k in range(len(folds))]
+    results = joblib.Parallel(n_jobs=n_jobs, verbose=verbose)(
+        joblib.delayed(score_vect_group)(pipeline, vect_params, group, data_in, data_out, *folds[k],
+                                         features=features, fingerprint=fingerprint)
+        for vect_params, indices, group, k in jobs)
+
+    scores = np.zeros((len(candidates), len(folds)))
+    for (vect_params, indices, group, k), fold_scores in zip(jobs, results):
+        scores[indices, k] = fold_scores
+    return scores.mean(axis=1)
+
+
+def successive_halving(pipeline, candidates, data_in, data_out, factor=2, min_samples=None, n_jobs=-1,
+                       seed=None, features=None, fingerprint=None):
+    """Successive halving over the number of training samples
+
+    Every candidate is first scored on a small random subset; only the best
+    1/factor of them move on to the next round, which uses factor times more
+    samples. The last round scores the few remaining candidates on the whole
+    dataset. kbest__k is clamped to the vocabulary of the small subsets (see
+    clamp_k), and candidates whose fit failed are dropped without taking the
+    place of a scored one.
+
+    Arguments:
+        pipeline {object}   -- pipeline, its first step is the vectorizer
+        candidates {list}   -- pipeline parameters, one dict per candidate
         data_in {list}      -- dataset text input
         data_out {list}     -- dataset category output
-        cat_name {text}     -- primary category name
-        models_path {text}  -- models path
+
+    Keyword Arguments:
+        factor {int}        -- reduction factor between two rounds (default: {2})
+        min_samples {int}   -- lower bound on the samples of a round (default: {None})
+        n_jobs {int}        -- number of parallel jobs, -1 for all cores (default: {-1})
+        seed {int}          -- random seed of the subsets (default: {None})
+        features {object}   -- FeatureStore caching the count matrices (default: {None})
+        fingerprint {text}  -- texts_fingerprint(data_in), computed if None (default: {None})
 
     Returns:
-        [string] -- clean text
+        [tuple] -- (index of the best candidate, score of each candidate in its last round)
+    """
+
+    data_out = np.asarray(data_out)
+    if features is not None and fingerprint is None:
+        fingerprint = texts_fingerprint(data_in)
+    n = len(data_out)
+    n_rounds = max(int(np.ceil(np.log(len(candidates)) / np.log(factor))) - 1, 0)
+    order = np.random.RandomState(seed).permutation(n)
+
+    alive = np.arange(len(candidates))
+    scores = np.full(len(candidates), np.nan)
+    for r in range(n_rounds + 1):
+        n_samples = min(max(n // factor ** (n_rounds - r), min_samples or 0), n)
+        rows = np.sort(order[:n_samples])
+        scores[alive] = evaluate_candidates(pipeline, [candidates[i] for i in alive], [data_in[i] for i in rows],
+                                            data_out[rows], n_jobs=n_jobs, verbose=0, features=features,
+                                            fingerprint=subset_fingerprint(fingerprint, rows) if fingerprint else None)
+        scored = alive[~np.isnan(scores[alive])]
+        if not len(scored):
+            raise ValueError("every candidate failed on %d samples" % n_samples)
+        ranking = scored[np.argsort(-scores[scored], kind='mergesort')]
+        print("%d candidates on %d samples (%d failed), best score %0.3f" % (
+            len(alive), n_samples, len(alive) - len(scored), scores[ranking[0]]))
+
+        if len(ranking) <= 1:
+            break
+        alive = ranking[:max(1, int(np.ceil(len(ranking) / float(factor))))]
+
+    return ranking[0], scores
+
+
+def fit_features(pipeline, params, data_in, data_out, train, features, test=None, fingerprint=None):
+    """Fit a pipeline on some rows, its count matrices coming from the feature store
+
+    Arguments:
+        pipeline {object}   -- pipeline, its first step is the vectorizer
+        params {dict}       -- pipeline parameters
+        data_in {list}      -- dataset text input
+        data_out {array}    -- dataset category output
+        train {array}       -- rows the pipeline is fitted on
+        features {object}   -- FeatureStore
+
+    Keyword Arguments:
+        test {array}        -- rows to transform as well (default: {None})
+        fingerprint {text}  -- texts_fingerprint(data_in), computed if None (default: {None})
+
+    Returns:
+        [tuple] -- (fitted pipeline, count matrix of the test rows or None)
+    """
+
+    vect_name = pipeline.steps[0][0]
+    vect_params, other_params = split_params(params, vect_name)
+    vect = clone(pipeline.steps[0][1]).set_params(**vect_params)
+    X_train, X_test = features.vectorize(vect, data_in, train, test, fingerprint=fingerprint)
+    rest = clone(Pipeline(pipeline.steps[1:]))
+    rest.set_params(**clamp_k(rest, other_params, X_train.shape[1]))
+    rest.fit(X_train, np.asarray(data_out)[train])
+    return Pipeline([(vect_name, vect)] + rest.steps), X_test
+
+
+def perform_grid_search(pipeline, data_in, data_out, catname, class_list, registry, n_iter=200, n_jobs=-1,
+                        seed=None, search='random', fingerprint=None, features=None, input_fingerprint=None,
+                        engine=None):
+    """Gridsearch for Pipeline
+
+    Random search over the parameters below. The count matrices of each fold
+    are computed once per vectorizer setting and shared by every candidate
+    using it (see evaluate_candidates), the best candidate is then refitted on
+    the whole dataset and saved as a new version in the registry. With
+    search='halving' weak candidates are pruned on small subsets first (see
+    successive_halving). With a feature store, count matrices computed by a
+    previous run on the same data are loaded from disk instead.
+
+    Arguments:
+        pipeline {object}        -- pipeline
+        data_in {list}           -- dataset text input
+        data_out {list}          -- dataset category output
+        cat_name {text}          -- primary category name
+        class_list {list}        -- class names, in the order of the encoded outputs
+        registry {object}        -- ModelRegistry
+        n_iter {int}             -- number of random candidates
+        n_jobs {int}             -- number of parallel jobs, -1 for all cores
+        seed {int}               -- random seed of the candidates
+        search {text}            -- search engine: 'random' or 'halving'
+        fingerprint {text}       -- fingerprint of the dataset
+        features {object}        -- FeatureStore caching the count matrices, or None
+        input_fingerprint {text} -- texts_fingerprint(data_in), computed once if None
+        engine {text}            -- cleaning engine of the dataset, recorded with the model
+
+    Returns:
+        [string] -- registered version
     """
 
     parameters = {
@@ -99,36 +398,48 @@ def perform_grid_search(pipeline, data_in, data_out, catname, models_path):
     }
 
     # Gridsearch
-    grid_search = RandomizedSearchCV(pipeline, parameters, n_jobs=4, verbose=5, n_iter=200)
+    candidates = list(ParameterSampler(parameters, n_iter=n_iter, random_state=seed))
 
     print("Parameters:")
     pprint(parameters)
 
     # Fitting
     t0 = time.time()
-    grid_search.fit(data_in, data_out)
+    if features is not None and input_fingerprint is None:
+        input_fingerprint = texts_fingerprint(data_in)
+    metrics.count('candidates', len(candidates))
+    with metrics.stage('search'):
+        if search == 'halving':
+            best, scores = successive_halving(pipeline, candidates, data_in, data_out, n_jobs=n_jobs, seed=seed,
+                                              features=features, fingerprint=input_fingerprint)
+        elif search == 'random':
+            scores = evaluate_candidates(pipeline, candidates, data_in, data_out, n_jobs=n_jobs, features=features,
+                                         fingerprint=input_fingerprint)
+            best = int(np.nanargmax(scores))
+        else:
+            raise ValueError("unknown search engine: " + search)
+    with metrics.stage('fit'):
+        if features is not None:
+            best_estimator, _ = fit_features(pipeline, candidates[best], data_in, data_out,
+                                             np.arange(len(data_in)), features, fingerprint=input_fingerprint)
+        else:
+            best_estimator = clone(pipeline).set_params(**candidates[best]).fit(data_in, data_out)
     print("done in %0.3fs" % (time.time() - t0))
 
     # Results
-    print("Best score: %0.3f" % grid_search.best_score_)
+    print("Best score: %0.3f" % scores[best])
     print("Best parameters set:")
-    best_parameters = grid_search.best_estimator_.get_params()
+    best_parameters = best_estimator.get_params()
     for param_name in sorted(parameters.keys()):
         print("\t%s: %r" % (param_name, best_parameters[param_name]))
 
-    # Save best_params, estimator and classlist in Pickle
-    current_time = time.strftime("%Y%m%d-%H%M%S")
-
-    best_params_filename_ = models_path + 'best_parameters_' + catname + '_' + str(current_time) + '.pkl'
-    joblib.dump(best_parameters, best_params_filename_, compress=1)
-
-    best_estimator_filename_ = models_path + 'estimator_' + catname + '_' + str(current_time) + '.pkl'
-    joblib.dump(grid_search.best_estimator_, best_estimator_filename_, compress=1)
-
-    classlist_filename_ = models_path + 'classlist_' + catname + '_' + str(current_time) + '.pkl'
-    joblib.dump(classList, classlist_filename_, compress=1)
-
-    return best_params_filename_, classlist_filename_
+    # Save estimator, classlist, searched parameters and score as one bundle
+    model_metrics = {'cv_score': float(scores[best]), 'search': search, 'nb_candidates': len(candidates)}
+    # The compact copy must score a sample of the texts as the refitted pipeline does
+    check_rows = np.random.RandomState(seed).choice(len(data_in), min(len(data_in), 1000), replace=False)
+    return registry.save(catname, best_estimator, class_list, params=candidates[best], metrics=model_metrics,
+                         fingerprint=fingerprint, compact=True, check_texts=[data_in[i] for i in check_rows],
+                         engine=engine)
 
 
 if __name__ == "__main__":
@@ -141,7 +452,15 @@ if __name__ == "__main__":
     element_per_cat = 8300
     test_size = 0.33
     seed = 7
-    models_path = './files/models/'
+    search = 'random'  # random: score every candidate | halving: successive halving over samples
+    dataset_path = './files/processed/dataset/'
+    registry_path = './files/models/registry/'
+    features_path = './files/features/'  # cached count matrices, None to always vectorize
+    features_max_bytes = 10 * 2 ** 30  # least recently used matrices are removed above this size
+    metrics_filename = './files/metrics/gridsearch.json'  # .prom for Prometheus text, None: not written
+    profile_stages = ()  # stages run under cProfile (ex: ('sample', 'fit')), joblib workers are not profiled
+
+    metrics.configure(profile_stages)
 
     # -------------------------------------------------------------------------
     # PIPELINE
@@ -159,7 +478,7 @@ if __name__ == "__main__":
     # -------------------------------------------------------------------------
 
     # create dataset from file
-    data = open_dataset('files/processed/dataset.p', cat_name, element_per_cat)
+    data = open_dataset(dataset_path, cat_name, element_per_cat, seed=seed)
 
     # encode output with labelencoder
     classList, encoded_output = encode_data(data, cat_name)
@@ -170,26 +489,42 @@ if __name__ == "__main__":
     # GRIDSEARCH
     # -------------------------------------------------------------------------
 
-    best_params_filename, classlist_filename = perform_grid_search(
-        pipeline, inp, out, cat_name, models_path)
+    registry = ModelRegistry(registry_path)
+    features = FeatureStore(features_path, max_bytes=features_max_bytes) if features_path else None
+    # Computed once, every feature store key of this run derives from it
+    input_fingerprint = texts_fingerprint(inp) if features is not None else None
+    dataset = ShardStore(dataset_path, columns=PROCESSED_COLUMNS)
+    version = perform_grid_search(pipeline, inp, out, cat_name, classList, registry, seed=seed, search=search,
+                                  fingerprint=dataset.fingerprint(), features=features,
+                                  input_fingerprint=input_fingerprint, engine=dataset.meta.get('engine'))
 
     # -------------------------------------------------------------------------
     # MODEL AND CONFUSION MATRIX - CLASSIFICATION REPORT
     # -------------------------------------------------------------------------
 
-    # Split dataset
-    X_train, X_test, y_train, y_test = model_selection.train_test_split(inp, out, test_size=test_size,
-                                                                        random_state=seed)
+    # Split dataset (row numbers, so that the count matrices can come from the feature store)
+    train_rows, test_rows = model_selection.train_test_split(np.arange(len(inp)), test_size=test_size,
+                                                             random_state=seed)
+    y_test = np.asarray(out)[test_rows]
     # Load best_params and class list
-    best_params = joblib.load(best_params_filename)
-    classList = joblib.load(classlist_filename)
+    bundle = registry.load_bundle(cat_name, version)
+    best_params = bundle['params']
+    classList = bundle['class_list']
 
     # Pipeline - Set previous parameters
-    pipeline.set_params(**best_params)
-    pipeline.fit(X_train, y_train)
+    with metrics.stage('fit'):
+        if features is not None:
+            pipeline, X_test = fit_features(pipeline, best_params, inp, out, train_rows, features, test_rows,
+                                            fingerprint=input_fingerprint)
+        else:
+            pipeline.set_params(**best_params)
+            pipeline.fit([inp[i] for i in train_rows], np.asarray(out)[train_rows])
+            X_test = [inp[i] for i in test_rows]
 
     # predict test instances
-    y_preds = pipeline.predict(X_test)
+    with metrics.stage('predict'):
+        y_preds = pipeline.predict(X_test) if features is None else Pipeline(pipeline.steps[1:]).predict(X_test)
+    metrics.count('predictions', len(y_preds))
 
     # confusion matrix
     matrix = confusion_matrix(y_test, y_preds)
@@ -197,3 +532,4 @@ if __name__ == "__main__":
 
     # classification report
     print(classification_report(y_test, y_preds, target_names=classList))
+    metrics.write(metrics_filename)
@@ -0,0 +1,168 @@
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.pipeline import Pipeline
+
+from instrumentation import metrics
+from model_registry import ModelRegistry
+from shard_store import PROCESSED_COLUMNS, ShardStore
+
+
+def get_test_mask(chunk_index, size, test_size, seed):
+    """Rows of a chunk kept for evaluation, identical on every pass
+
+    Arguments:
+        chunk_index {int}   -- position of the chunk in the dataset
+        size {int}          -- number of rows of the chunk
+        test_size {float}   -- share of rows kept for evaluation
+        seed {int}          -- random seed
+
+    Returns:
+        [array] -- boolean mask, True for test rows
+    """
+
+    return np.random.RandomState([seed, chunk_index]).rand(size) < test_size
+
+
+def iter_labelled_chunks(store, catname, class_index, order=None):
+    """Read the dataset chunk by chunk with encoded labels
+
+    Arguments:
+        store {ShardStore}  -- processed dataset
+        catname {text}      -- category column
+        class_index {dict}  -- class name -> class id
+
+    Keyword Arguments:
+        order {array}   -- chunk indices to read, in this order, all of them in storage order if None
+                           (default: {None})
+
+    Returns:
+        [generator] -- (chunk index in storage order, list of texts, array of class ids)
+    """
+
+    names = store.names()
+    for i in (range(len(names)) if order is None else order):
+        shard = store.shard(names[i])
+        metrics.count('chunks_read')
+        yield i, shard.column('input'), np.array([class_index[c] for c in shard.column(catname)])
+
+
+def train_streaming(path, catname, vectorizer, classifier, epochs=1, test_size=0.33, seed=7):
+    """Train a hashing vectorizer + SGD pipeline with partial_fit, one dataset chunk at a time
+
+    The vectorizer is stateless, so no vocabulary is kept and memory is
+    bounded by the chunk size. Classes are weighted by their inverse frequency,
+    which is known from the category column before training starts. The
+    dataset is sorted by category, so the chunk order and the rows of each
+    chunk are shuffled on every epoch: SGD never sees long single-class runs.
+
+    Arguments:
+        path {text}                     -- processed dataset folder
+        catname {text}                  -- category column (cat_main or cat_sub)
+        vectorizer {HashingVectorizer}  -- text vectorizer
+        classifier {SGDClassifier}      -- linear model supporting partial_fit
+
+    Keyword Arguments:
+        epochs {int}        -- number of passes over the training rows (default: {1})
+        test_size {float}   -- share of rows kept for evaluation (default: {0.33})
+        seed {int}          -- random seed of the test rows and of the shuffling (default: {7})
+
+    Returns:
+        [tuple] -- (fitted Pipeline, class list, true test labels, predicted test labels)
+    """
+
+    store = ShardStore(path, columns=PROCESSED_COLUMNS)
+
+    # Labels only: class list and class weights without decoding the texts
+    codes, categories = store.category_codes(catname)
+    classList = sorted(categories)
+    class_index = {c: i for i, c in enumerate(classList)}
+    to_class = np.array([class_index[c] for c in categories])
+    counts = np.bincount(to_class[codes], minlength=len(classList))
+    class_weight = len(codes) / (len(classList) * np.maximum(counts, 1).astype(float))
+    classes = np.arange(len(classList))
+
+    rng = np.random.RandomState(seed)
+    nb_docs = 0
+    t0 = time.time()
+    for epoch in range(epochs):
+        order = rng.permutation(len(store.names()))
+        for i, texts, y in iter_labelled_chunks(store, catname, class_index, order=order):
+            train = np.flatnonzero(~get_test_mask(i, len(y), test_size, seed))
+            rng.shuffle(train)
+            with metrics.stage('vectorize'):
+                X = vectorizer.transform([texts[j] for j in train])
+            with metrics.stage('fit'):
+                classifier.partial_fit(X, y[train], classes=classes, sample_weight=class_weight[y[train]])
+            nb_docs += len(train)
+            metrics.count('docs_trained', len(train))
+        print("epoch %d: %d docs in %0.3fs (%0.1f docs/s)" % (epoch + 1, nb_docs, time.time() - t0,
+                                                              nb_docs / max(time.time() - t0, 1e-9)))
+
+    # Evaluate on the rows left out of every chunk
+    y_test, y_preds = [], []
+    for i, texts, y in iter_labelled_chunks(store, catname, class_index):
+        test = get_test_mask(i, len(y), test_size, seed)
+        if test.any():
+            y_test.append(y[test])
+            with metrics.stage('predict'):
+                y_preds.append(classifier.predict(vectorizer.transform([t for t, keep in zip(texts, test)
+                                                                        if keep])))
+
+    pipeline = Pipeline([('vect', vectorizer), ('SGD', classifier)])
+    if not y_test:
+        return pipeline, classList, np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return pipeline, classList, np.concatenate(y_test), np.concatenate(y_preds)
+
+
+if __name__ == "__main__":
+
+    # -------------------------------------------------------------------------
+    # PARAMETERS
+    # -------------------------------------------------------------------------
+
+    cat_name = 'cat_main'  # cat_main: main category (ex: Computer Science) | cat_sub : sub category (ex:cs.CL)
+    dataset_path = './files/processed/dataset/'
+    registry_path = './files/models/registry/'
+    test_size = 0.33
+    seed = 7
+    epochs = 2
+    metrics_filename = './files/metrics/train_streaming.json'  # .prom for Prometheus text, None: not written
+    profile_stages = ()  # stages run under cProfile (ex: ('vectorize', 'fit'))
+
+    metrics.configure(profile_stages)
+
+    # -------------------------------------------------------------------------
+    # PIPELINE - stateless vectorizer, probabilistic loss for predict_proba
+    # -------------------------------------------------------------------------
+
+    vectorizer = HashingVectorizer(n_features=2 ** 22, ngram_range=(1, 2), alternate_sign=False, norm='l2')
+    classifier = SGDClassifier(loss='modified_huber', penalty='l2', alpha=0.000001, random_state=seed)
+
+    # -------------------------------------------------------------------------
+    # TRAINING
+    # -------------------------------------------------------------------------
+
+    pipeline, classList, y_test, y_preds = train_streaming(dataset_path, cat_name, vectorizer, classifier,
+                                                           epochs=epochs, test_size=test_size, seed=seed)
+
+    # Register under the same name as 3_gridsearch.py so the prediction scripts can load it, the hashing
+    # vectorizer has no vocabulary to prune so no compact copy is exported
+    accuracy = float(np.mean(y_test == y_preds)) if len(y_test) else None
+    registry = ModelRegistry(registry_path)
+    dataset = ShardStore(dataset_path, columns=PROCESSED_COLUMNS)
+    version = registry.save(cat_name, pipeline, classList, params={'epochs': epochs, 'test_size': test_size},
+                            metrics={'test_accuracy': accuracy}, fingerprint=dataset.fingerprint(),
+                            compact=False, engine=dataset.meta.get('engine'))
+    print("registered " + cat_name + " " + version)
+
+    # -------------------------------------------------------------------------
+    # CONFUSION MATRIX - CLASSIFICATION REPORT
+    # -------------------------------------------------------------------------
+
+    print(confusion_matrix(y_test, y_preds))
+    print(classification_report(y_test, y_preds, target_names=classList))
+    metrics.write(metrics_filename)
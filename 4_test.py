@@ -1,66 +1,33 @@
-import string
+import os
 
-from nltk import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from sklearn.externals import joblib
-
-wordnet = WordNetLemmatizer()
-
-
-def clean_text(text):
-    """Clean raw text using different methods :
-       1. tokenize text
-       2. lower text
-       3. remove punctuation
-       4. remove non-alphabetics char
-       5. remove stopwords
-       6. lemmatize
-
-    Arguments:
-        text {string} -- raw text
-
-    Returns:
-        [string] -- clean text
-    """
-
-    # split into words
-    tokens = word_tokenize(text)
-    # convert to lower case
-    tokens = [w.lower() for w in tokens]
-    # remove punctuation from each word
-    table = str.maketrans('', '', string.punctuation)
-    stripped = [w.translate(table) for w in tokens]
-    # remove remaining tokens that are not alphabetic
-    words = [word for word in stripped if word.isalpha()]
-    # filter out stop words
-    stop_words = set(stopwords.words('english'))
-    words = [w for w in words if not w in stop_words]
-
-    stemmed = [wordnet.lemmatize(word) for word in words]
-
-    return ' '.join(stemmed)
-
-
-def get_class_name_from_proba(proba_array, enc):
-    """Get class name from labelencoder
-
-    Arguments:
-        proba_array {array} -- list of propability
-        enc                 -- array with labelencoder's values
-
-    Returns:
-        [string] -- class name
-    """
-    idx = proba_array.flatten().argmax(axis=0)
-    return enc[idx]
+from inference import get_class_name_from_proba
+from instrumentation import metrics
+from model_registry import ModelRegistry
+from preprocessing import clean_text, init_worker
 
 
 if __name__ == '__main__':
     models_path = './files/models/'
-
-    classList = joblib.load(models_path + 'classlist_cat_main_20180423-234137.pkl')
-    clf = joblib.load(models_path + 'estimator_cat_main_20180423-234137.pkl')
+    cat_name = 'cat_main'
+    version = 'latest'  # or a pinned version (ex: 20180423-234137)
+    legacy_version = '20180423-234137'  # timestamped pickles written before the registry
+    metrics_filename = None  # stage timings and counters (ex: './files/metrics/test.json'), None: not written
+    lemma_table = './files/processed/lemmas.json'  # written by 2_create_dataset.py, WordNet only for unknown tokens
+    engine = 'nltk'  # tokenizer the dataset was cleaned with, checked against the model
+
+    init_worker(engine=engine, lemma_table=lemma_table if os.path.exists(lemma_table) else None)
+
+    registry = ModelRegistry(models_path + 'registry/')
+    if not registry.versions(cat_name) and os.path.exists(
+            models_path + 'estimator_' + cat_name + '_' + legacy_version + '.pkl'):
+        registry.import_legacy(models_path, cat_name, legacy_version)
+
+    # Compact copy (see compact_model.py), the pickled pipeline for bundles saved without one
+    with metrics.stage('load_model'):
+        predictor = registry.load(cat_name, version, compact=True, engine=engine)
+    clf = predictor.estimator
+    classList = predictor.class_list
+    print("model " + cat_name + " " + predictor.version)
 
     t = [clean_text(
         "At some point you just need to stop looking and be blissfully ignorant...this was not one of those days. In "
@@ -81,7 +48,8 @@ if __name__ == '__main__':
         "diskmanagementd logs that I had found in the unified logs. Why are they logged in the software installation "
         "log at all, I have no clue. It makes absolutely no sense to me.")]
 
-    pred = clf.predict_proba(t)
+    with metrics.stage('predict'):
+        pred = clf.predict_proba(t)
     print(pred)
     className = get_class_name_from_proba(pred, classList)
     print(className)
@@ -132,7 +100,10 @@ if __name__ == '__main__':
                     '- 180961372 0GE7SgHgQRRboBTT.99 Give the gift of Smithsonian magazine for only $12! http: // '
                     'bit.ly / 1cGUiGv Follow us: @SmithsonianMag on Twitter')]
 
-    pred = clf.predict_proba(t)
+    with metrics.stage('predict'):
+        pred = clf.predict_proba(t)
     print(pred)
     className = get_class_name_from_proba(pred, classList)
     print(className)
+
+    metrics.write(metrics_filename)
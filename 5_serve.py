@@ -0,0 +1,212 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from instrumentation import metrics
+from model_registry import ModelRegistry
+from preprocessing import clean_text, init_worker
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MicroBatcher(object):
+    """Group the posts of concurrent requests into one predict_proba call.
+
+    A single worker thread waits for a first request, then collects more for
+    at most max_wait seconds or until max_batch_size posts are pending.
+    """
+
+    def __init__(self, predictor, max_batch_size=64, max_wait=0.005):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.nb_batches = 0
+        self.nb_predictions = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, texts):
+        """Queue clean texts for prediction
+
+        Arguments:
+            texts {list} -- clean texts
+
+        Returns:
+            [Future] -- list of predictions, see Predictor.predict
+        """
+
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _collect(self):
+        items = [self._queue.get()]
+        nb_texts = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while nb_texts < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            nb_texts += len(items[-1][0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            texts = [text for item_texts, _ in items for text in item_texts]
+            try:
+                with metrics.stage('predict'):
+                    predictions = self.predictor.predict(texts, clean=False)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            self.nb_batches += 1
+            self.nb_predictions += len(texts)
+            metrics.count('batches')
+            metrics.count('predictions', len(texts))
+            start = 0
+            for item_texts, future in items:
+                future.set_result(predictions[start:start + len(item_texts)])
+                start += len(item_texts)
+
+
+def make_handler(batcher, registry, name, engine=None):
+    """Build the request handler class bound to a batcher
+
+    Arguments:
+        batcher {MicroBatcher}      -- prediction batcher
+        registry {ModelRegistry}    -- registry the model is reloaded from
+        name {text}                 -- registered model name
+
+    Keyword Arguments:
+        engine {text} -- cleaning engine of the server, a reloaded model must have been trained with it
+                         (default: {None})
+
+    Returns:
+        [class] -- BaseHTTPRequestHandler subclass
+    """
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        """POST /predict {"text": "..."} or {"texts": ["...", ...]}, POST /reload {"version": "..."},
+        GET /health, GET /metrics (Prometheus text)"""
+
+        def send_json(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                data = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                return self.wfile.write(data)
+            if self.path != '/health':
+                return self.send_json(404, {'error': 'not found'})
+            self.send_json(200, {'status': 'ok',
+                                 'version': batcher.predictor.version,
+                                 'engine': batcher.predictor.engine,
+                                 'batches': batcher.nb_batches,
+                                 'predictions': batcher.nb_predictions})
+
+        def do_POST(self):
+            if self.path == '/reload':
+                return self.reload()
+            if self.path != '/predict':
+                return self.send_json(404, {'error': 'not found'})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                texts = body['texts'] if 'texts' in body else [body['text']]
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    raise TypeError(texts)
+            except (ValueError, KeyError, TypeError):
+                return self.send_json(400, {'error': 'expected {"text": ...} or {"texts": [...]}'})
+
+            # Any failure past the request parsing is reported to the client, never left without a response
+            try:
+                with metrics.stage('clean'):
+                    texts = [clean_text(text) for text in texts]
+                predictions = batcher.submit(texts).result()
+            except Exception as e:
+                metrics.count('errors')
+                return self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            self.send_json(200, {'predictions': predictions})
+
+        def reload(self):
+            """Swap the model for a registered version, "latest" by default, without a restart"""
+
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+                version = body.get('version', 'latest')
+            except (ValueError, AttributeError) as e:
+                return self.send_json(400, {'error': str(e)})
+
+            # Any load failure (unreadable bundle, other engine...) keeps the current model and is reported
+            try:
+                predictor = registry.load(name, version, engine=engine)
+            except KeyError as e:
+                return self.send_json(404, {'error': e.args[0]})
+            except Exception as e:
+                metrics.count('errors')
+                return self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+
+            # The batcher reads the attribute once per batch, running batches keep the previous model
+            batcher.predictor = predictor
+            self.send_json(200, {'version': predictor.version})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+
+if __name__ == '__main__':
+
+    # -------------------------------------------------------------------------
+    # PARAMETERS
+    # -------------------------------------------------------------------------
+
+    host = '127.0.0.1'
+    port = 8000
+    registry_path = './files/models/registry/'
+    cat_name = 'cat_main'
+    version = 'latest'  # POST /reload switches to another version later
+    engine = 'nltk'  # tokenizer the dataset was cleaned with, see preprocessing.py
+    lemma_table = './files/processed/lemmas.json'  # written by 2_create_dataset.py
+    max_batch_size = 64
+    max_wait = 0.005  # seconds a request may wait for others to join its batch
+
+    # -------------------------------------------------------------------------
+    # SERVER - model and cleaner are loaded once
+    # -------------------------------------------------------------------------
+
+    registry = ModelRegistry(registry_path)
+    predictor = registry.load(cat_name, version, engine=engine)
+    init_worker(engine=engine, lemma_table=lemma_table if os.path.exists(lemma_table) else None)
+    clean_text('warm up the NLTK corpora')
+
+    batcher = MicroBatcher(predictor, max_batch_size=max_batch_size, max_wait=max_wait)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, registry, cat_name, engine))
+    print("Serving %s %s on http://%s:%d/predict" % (cat_name, predictor.version, host, port))
+    server.serve_forever()
@@ -0,0 +1,167 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice, tee
+
+from instrumentation import metrics
+from model_registry import ModelRegistry
+from preprocessing import ENGINES, clean_texts
+
+
+def read_posts(stream, file_format):
+    """Read posts lazily from a JSONL or CSV stream
+
+    Arguments:
+        stream {file}       -- text stream
+        file_format {text}  -- 'jsonl' or 'csv'
+
+    Returns:
+        [generator] -- one dict per post
+    """
+
+    if file_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_text(post, fields):
+    """Join the text fields of a post (ex: title and text of a Hacker News item)"""
+
+    return ' '.join(str(post[field]) for field in fields if post.get(field))
+
+
+def prepare_output(filename, block_size=1 << 20):
+    """Count the results already written and drop a partially written last line
+
+    The file is read by blocks: backwards from the end to find the last
+    complete line, then forwards to count the lines.
+
+    Arguments:
+        filename {text} -- output JSONL file
+
+    Keyword Arguments:
+        block_size {int} -- bytes read at once (default: {1 << 20})
+
+    Returns:
+        [int] -- number of posts already scored
+    """
+
+    if not os.path.exists(filename):
+        return 0
+
+    with open(filename, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        complete = 0
+        end = size
+        while end > 0:
+            start = max(end - block_size, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                complete = start + newline + 1
+                break
+            end = start
+        if complete != size:
+            f.truncate(complete)
+
+        f.seek(0)
+        nb_lines = 0
+        remaining = complete
+        while remaining:
+            block = f.read(min(block_size, remaining))
+            nb_lines += block.count(b'\n')
+            remaining -= len(block)
+    return nb_lines
+
+
+def score_posts(posts, predictor, fields, id_field, batch_size=1000, n_jobs=None, chunksize=200, engine='nltk',
+                lemma_table=None):
+    """Clean posts with a process pool and score them by batches
+
+    Arguments:
+        posts {iterable}        -- posts (dict)
+        predictor {Predictor}   -- loaded model
+        fields {list}           -- text fields of a post
+        id_field {text}         -- field copied to the results
+
+    Keyword Arguments:
+        batch_size {int}    -- number of posts per predict_proba call (default: {1000})
+        n_jobs {int}        -- number of cleaning processes, all cores if None (default: {None})
+        chunksize {int}     -- number of texts sent to a cleaning process at once (default: {200})
+        engine {text}       -- tokenizer, 'nltk' or 'fast' (default: {'nltk'})
+        lemma_table {text}  -- lemma table of the training corpus (default: {None})
+
+    Returns:
+        [generator] -- list of results per batch, in input order
+    """
+
+    posts, pending = tee(posts)
+    cleaned = clean_texts((get_text(post, fields) for post in posts), n_jobs=n_jobs, chunksize=chunksize,
+                          engine=engine, lemma_table=lemma_table)
+    scored = zip(pending, cleaned)
+
+    for batch in iter(lambda: list(islice(scored, batch_size)), []):
+        with metrics.stage('predict'):
+            predictions = predictor.predict([text for _, text in batch], clean=False)
+        yield [dict(prediction, id=post.get(id_field)) for (post, _), prediction in zip(batch, predictions)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify a JSONL/CSV file of posts, resuming any previous run.')
+    parser.add_argument('input', help="JSONL or CSV file, '-' for stdin")
+    parser.add_argument('output', help='JSONL results, appended to when it already exists')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='input format, guessed from the extension')
+    parser.add_argument('--fields', nargs='+', default=['title', 'text'], help='text fields of a post')
+    parser.add_argument('--id-field', default='id')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--n-jobs', type=int, default=None, help='cleaning processes, all cores by default')
+    parser.add_argument('--engine', choices=ENGINES, default='nltk', help='tokenizer the dataset was cleaned with')
+    parser.add_argument('--lemma-table', default='./files/processed/lemmas.json',
+                        help='lemma table written by 2_create_dataset.py, WordNet only for unknown tokens')
+    parser.add_argument('--registry', default='./files/models/registry/')
+    parser.add_argument('--model', default='cat_main', help='registered model name')
+    parser.add_argument('--version', default='latest', help="model version, 'latest' by default")
+    parser.add_argument('--compact', action='store_true', help='use the compact model instead of the pipeline')
+    parser.add_argument('--metrics', help='write stage timings and counters (.json, or .prom for Prometheus)')
+    parser.add_argument('--profile', nargs='*', default=(), help='stages run under cProfile (ex: predict)')
+    args = parser.parse_args()
+
+    file_format = args.format or ('csv' if args.input.endswith('.csv') else 'jsonl')
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if args.input == '-' else \
+        open(args.input, encoding='utf-8', newline='')
+
+    metrics.configure(args.profile)
+    with metrics.stage('load_model'):
+        predictor = ModelRegistry(args.registry).load(args.model, args.version, compact=args.compact,
+                                                      engine=args.engine)
+    print("model %s %s" % (args.model, predictor.version))
+
+    # Resume: skip the posts whose result is already in the output
+    done = prepare_output(args.output)
+    if done:
+        print("Resuming after %d posts" % done)
+    posts = islice(read_posts(stream, file_format), done, None)
+
+    nb_posts = 0
+    t0 = time.time()
+    with open(args.output, 'a', encoding='utf-8') as out:
+        for results in score_posts(posts, predictor, args.fields, args.id_field, batch_size=args.batch_size,
+                                   n_jobs=args.n_jobs, engine=args.engine,
+                                   lemma_table=args.lemma_table if os.path.exists(args.lemma_table) else None):
+            out.write(''.join(json.dumps(result) + '\n' for result in results))
+            out.flush()
+            nb_posts += len(results)
+            metrics.count('posts', len(results))
+            print("%d posts, %0.1f posts/s" % (done + nb_posts, nb_posts / max(time.time() - t0, 1e-9)))
+
+    print("Scored %d posts in %0.3fs" % (nb_posts, time.time() - t0))
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,46 @@
+"""Compare get_entries (whole-document ElementTree) with the streaming iter_entries parser.
+
+    python -m benchmarks.bench_atom_parser [nb_entries]
+"""
+import io
+import sys
+import tracemalloc
+from xml.etree import ElementTree
+
+from benchmarks.utils import load_script, synthetic_feed, timed
+
+arxiv = load_script('1_get_data_arxiv.py')
+
+
+def parse_tree(feed):
+    return arxiv.get_entries(ElementTree.fromstring(feed), 'Computer Science')
+
+
+def parse_stream(feed):
+    # Consume the generator without keeping the records, as a consumer writing
+    # each entry to disk would
+    nb_entries = 0
+    for _ in arxiv.iter_entries(io.BytesIO(feed), 'Computer Science'):
+        nb_entries += 1
+    return nb_entries
+
+
+def measure(func, feed):
+    """Run func once for timing and once under tracemalloc for the peak memory"""
+
+    _, elapsed = timed(func, feed)
+    tracemalloc.start()
+    func(feed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    nb_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    feed = synthetic_feed(nb_entries)
+    print("feed: %d entries, %0.1f MB" % (nb_entries, len(feed) / 1e6))
+
+    for name, func in (('get_entries', parse_tree), ('iter_entries', parse_stream)):
+        elapsed, peak = measure(func, feed)
+        print("%-13s %10.0f entries/s   peak %8.1f MB" % (name, nb_entries / elapsed, peak / 1e6))
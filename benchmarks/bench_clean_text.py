@@ -0,0 +1,62 @@
+"""Per-document latency of the original clean_text against TextCleaner.
+
+    python -m benchmarks.bench_clean_text [nb_docs]
+
+Needs the NLTK punkt, stopwords and wordnet data.
+"""
+import random
+import string
+import sys
+import time
+
+from nltk import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+from benchmarks.utils import synthetic_text
+from preprocessing import TextCleaner
+
+wordnet = WordNetLemmatizer()
+
+
+def legacy_clean_text(text):
+    """clean_text as it was before TextCleaner: setup repeated on every call"""
+
+    tokens = word_tokenize(text)
+    tokens = [w.lower() for w in tokens]
+    table = str.maketrans('', '', string.punctuation)
+    stripped = [w.translate(table) for w in tokens]
+    words = [word for word in stripped if word.isalpha()]
+    stop_words = set(stopwords.words('english'))
+    words = [w for w in words if not w in stop_words]
+    stemmed = [wordnet.lemmatize(word) for word in words]
+    return ' '.join(stemmed)
+
+
+def latencies(func, docs):
+    result = []
+    for doc in docs:
+        t0 = time.perf_counter()
+        func(doc)
+        result.append(time.perf_counter() - t0)
+    return sorted(result)
+
+
+def report(name, values):
+    mean = sum(values) / len(values)
+    print("%-12s mean %7.3f ms   p50 %7.3f ms   p99 %7.3f ms" % (
+        name, mean * 1e3, values[len(values) // 2] * 1e3, values[int(len(values) * 0.99)] * 1e3))
+
+
+if __name__ == '__main__':
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(0)
+    docs = [synthetic_text(rng, 150) for _ in range(nb_docs)]
+
+    # Warm up the lazily loaded NLTK corpora so that both sides start equal
+    legacy_clean_text(docs[0])
+    cleaner = TextCleaner()
+
+    report('clean_text', latencies(legacy_clean_text, docs))
+    report('TextCleaner', latencies(cleaner.clean, docs))
+    print(cleaner.cache_info())
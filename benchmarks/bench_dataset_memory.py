@@ -0,0 +1,87 @@
+"""Peak memory of reading the processed dataset: one pickled list against chunks.
+
+    python -m benchmarks.bench_dataset_memory [nb_records | dataset folder]
+
+With a folder (ex: files/processed/dataset/) the current corpus is used,
+otherwise a synthetic corpus of nb_records is generated. Peaks are measured
+with tracemalloc, memory-mapped shard pages are not counted as they belong
+to the page cache.
+"""
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.utils import load_script, synthetic_text, timed
+from shard_store import PROCESSED_COLUMNS, ChunkWriter, ShardStore
+
+gridsearch = load_script('3_gridsearch.py')
+
+
+def synthetic_records(nb_records, seed=0):
+    rng = random.Random(seed)
+    for i in range(nb_records):
+        summary = synthetic_text(rng, 90).lower()
+        title = synthetic_text(rng, 6).lower()
+        yield {'id': '1804.%05d' % i, 'title': title, 'sum': summary, 'input': summary + ' ' + title,
+               'cat_main': rng.choice(['Physics', 'Mathematics', 'Computer Science']), 'cat_sub': 'cs.LG'}
+
+
+def read_pickle(filename, _):
+    return len(pd.DataFrame(pickle.load(open(filename, "rb"))))
+
+
+def read_columns(_, path):
+    return len(pd.concat(gridsearch.iter_dataset(path, ['id', 'input', 'cat_main', 'cat_sub'])))
+
+
+def read_sample(_, path):
+    return len(gridsearch.open_dataset(path, 'cat_main', 1000, seed=7))
+
+
+def stream_chunks(_, path):
+    nb_words = 0
+    for chunk in gridsearch.iter_dataset(path, ['input']):
+        nb_words += chunk.input.str.count(' ').sum()
+    return nb_words
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    _, elapsed = timed(func, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    workdir = tempfile.mkdtemp()
+    try:
+        argument = sys.argv[1] if len(sys.argv) > 1 else '100000'
+        if os.path.isdir(argument):
+            path = argument
+            records = ShardStore(path, columns=PROCESSED_COLUMNS).iter_records()
+        else:
+            path = os.path.join(workdir, 'dataset')
+            with ChunkWriter(ShardStore(path, columns=PROCESSED_COLUMNS)) as writer:
+                for record in synthetic_records(int(argument)):
+                    writer.write(record)
+            records = ShardStore(path, columns=PROCESSED_COLUMNS).iter_records()
+
+        filename = os.path.join(workdir, 'dataset.p')
+        pickle.dump(list(records), open(filename, "wb"))
+        print("records: %d, pickle %0.1f MB" % (len(ShardStore(path)), os.path.getsize(filename) / 1e6))
+
+        for name, func in (('pickle + DataFrame', read_pickle),
+                           ('iter_dataset (4 columns)', read_columns),
+                           ('open_dataset (1000/cat)', read_sample),
+                           ('iter_dataset (input)', stream_chunks)):
+            elapsed, peak = measure(func, filename, path)
+            print("%-26s %8.3fs   peak %8.1f MB" % (name, elapsed, peak / 1e6))
+    finally:
+        shutil.rmtree(workdir)
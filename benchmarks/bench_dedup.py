@@ -0,0 +1,60 @@
+"""Lookup time and accuracy of the near-duplicate index as it grows.
+
+Distinct synthetic documents are indexed in steps; after each step, edited
+copies of indexed documents (a few words replaced) and new documents are
+looked up. The time per lookup should stay flat while the index grows.
+
+    python -m benchmarks.bench_dedup [nb_docs] [nb_steps]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import synthetic_corpus
+from dedup import DedupIndex
+
+
+def edit(seed, text, nb_words):
+    words = text.split()
+    for i in range(nb_words):
+        words[(seed * 7919 + i * 104729) % len(words)] = 'edited%d' % i
+    return ' '.join(words)
+
+
+if __name__ == '__main__':
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    nb_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    nb_queries = 1000
+    texts, _ = synthetic_corpus(nb_docs + nb_queries, seed=0)
+    fresh = texts[nb_docs:]
+
+    path = tempfile.mkdtemp()
+    try:
+        index = DedupIndex(path)
+        step = nb_docs // nb_steps
+        print("%10s %12s %12s %10s %10s %10s" % ('records', 'add_us', 'lookup_us', 'recall_2w', 'recall_5w',
+                                                  'false_pos'))
+        for start in range(0, step * nb_steps, step):
+            t0 = time.perf_counter()
+            for i in range(start, start + step):
+                index.add_text(str(i), texts[i], check=False)
+            index.save()
+            add_time = (time.perf_counter() - t0) / step
+
+            rows = range(0, start + step, max(1, (start + step) // nb_queries))[:nb_queries]
+            recalls = []
+            t0 = time.perf_counter()
+            for nb_words in (2, 5):
+                found = 0
+                for row in rows:
+                    signature = index.signature(edit(row, texts[row], nb_words))
+                    found += index.find_near_duplicate(signature) == row
+                recalls.append(found / float(len(rows)))
+            false_positives = sum(index.find_near_duplicate(index.signature(text)) is not None for text in fresh)
+            lookup_time = (time.perf_counter() - t0) / (2 * len(rows) + len(fresh))
+
+            print("%10d %12.1f %12.1f %10.3f %10.3f %10d" % (len(index), 1e6 * add_time, 1e6 * lookup_time,
+                                                             recalls[0], recalls[1], false_positives))
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,54 @@
+"""Agreement and speed of the 'fast' cleaning engine against the NLTK one.
+
+    python -m benchmarks.bench_fast_cleaner [nb_docs]
+
+Uses the titles and abstracts of the raw store (files/raw/) when it holds
+shards, synthetic abstracts otherwise. Needs the NLTK punkt, stopwords and
+wordnet data.
+"""
+import random
+import sys
+from collections import Counter
+from itertools import islice
+
+from benchmarks.utils import synthetic_abstract, timed
+from preprocessing import TextCleaner
+from shard_store import ShardStore
+
+
+def load_docs(nb_docs):
+    store = ShardStore('./files/raw/')
+    if len(store):
+        return [r['title'] + ' ' + r['sum'] for r in islice(store.iter_records(['title', 'sum']), nb_docs)]
+    rng = random.Random(0)
+    return [synthetic_abstract(rng, 8) for _ in range(nb_docs)]
+
+
+def agreement(expected, result):
+    """Share of identical documents and of common tokens"""
+
+    identical = sum(a == b for a, b in zip(expected, result))
+    common = total = 0
+    for a, b in zip(expected, result):
+        a, b = Counter(a.split()), Counter(b.split())
+        common += sum((a & b).values())
+        total += max(sum(a.values()), sum(b.values()))
+    return identical / len(expected), common / max(total, 1)
+
+
+if __name__ == '__main__':
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    docs = load_docs(nb_docs)
+
+    cleaners = {engine: TextCleaner(engine=engine) for engine in ('nltk', 'fast')}
+    results = {}
+    for engine, cleaner in cleaners.items():
+        # First pass fills the lemma cache, the second one is timed
+        [cleaner.clean(doc) for doc in docs]
+        results[engine], elapsed = timed(lambda: [cleaner.clean(doc) for doc in docs])
+        print("%-5s %8.1f docs/s" % (engine, len(docs) / elapsed))
+
+    documents, tokens = agreement(results['nltk'], results['fast'])
+    print("identical documents %0.2f%%, common tokens %0.3f%%" % (100 * documents, 100 * tokens))
+    for a, b in islice(((a, b) for a, b in zip(results['nltk'], results['fast']) if a != b), 3):
+        print("nltk: " + a + "\nfast: " + b)
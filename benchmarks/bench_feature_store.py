@@ -0,0 +1,62 @@
+"""Search and refit wall time with and without the feature store of 3_gridsearch.py.
+
+The same candidates are scored by evaluate_candidates without a store, with an
+empty store (cold: the count matrices are computed and saved) and with the
+filled store (warm: they are memory-mapped). The final fit of the best
+candidate is timed the same way, scores must be identical in every run.
+
+    python -m benchmarks.bench_feature_store [nb_docs] [n_iter]
+"""
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from sklearn.model_selection import ParameterSampler
+
+from benchmarks.bench_grid_search import PARAMETERS, build_pipeline
+from benchmarks.utils import load_script, synthetic_corpus, timed
+from feature_store import FeatureStore, texts_fingerprint
+
+gridsearch = load_script('3_gridsearch.py')
+
+
+def search(texts, labels, candidates, features):
+    return gridsearch.evaluate_candidates(build_pipeline(), candidates, texts, labels, n_jobs=1, verbose=0,
+                                          features=features)
+
+
+def refit(texts, labels, params, features):
+    rows = np.arange(len(texts))
+    if features is None:
+        return build_pipeline().set_params(**params).fit(texts, labels)
+    return gridsearch.fit_features(build_pipeline(), params, texts, labels, rows, features)[0]
+
+
+if __name__ == '__main__':
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    n_iter = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    texts, labels = synthetic_corpus(nb_docs)
+    labels = np.asarray(labels)
+    candidates = list(ParameterSampler(PARAMETERS, n_iter=n_iter, random_state=0))
+
+    path = tempfile.mkdtemp()
+    try:
+        features = FeatureStore(path)
+        _, elapsed = timed(texts_fingerprint, texts)
+        print("%-24s %8.3fs" % ('texts_fingerprint', elapsed))
+
+        results = []
+        for name, store in (('no store', None), ('cold store', features), ('warm store', features)):
+            scores, search_time = timed(search, texts, labels, candidates, store)
+            best = int(np.nanargmax(scores))
+            estimator, fit_time = timed(refit, texts, labels, candidates[best], store)
+            results.append((scores, estimator.predict(texts[:200])))
+            print("%-24s search %8.3fs   refit %7.3fs   best score %0.3f" % (name, search_time, fit_time,
+                                                                            scores[best]))
+
+        identical = all(np.array_equal(scores, results[0][0], equal_nan=True) and
+                        np.array_equal(predictions, results[0][1]) for scores, predictions in results)
+        print("identical scores and predictions: %s" % identical)
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,83 @@
+"""Docs/s and peak RSS of the in-memory 3_gridsearch.py pipeline against 3_train_streaming.py.
+
+    python -m benchmarks.bench_out_of_core [nb_docs]
+
+Each trainer runs in a fresh process so that ru_maxrss is its own peak.
+"""
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import synthetic_corpus
+from shard_store import PROCESSED_COLUMNS, ChunkWriter, ShardStore
+
+
+def write_dataset(path, nb_docs):
+    texts, labels = synthetic_corpus(nb_docs)
+    with ChunkWriter(ShardStore(path, columns=PROCESSED_COLUMNS), chunk_size=5000) as writer:
+        for i, (text, label) in enumerate(zip(texts, labels)):
+            writer.write({'id': str(i), 'title': '', 'sum': '', 'input': text, 'cat_main': label, 'cat_sub': label})
+
+
+def fit_in_memory(path):
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    from sklearn.feature_selection import SelectKBest, chi2
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+
+    store = ShardStore(path, columns=PROCESSED_COLUMNS)
+    texts, labels = store.column('input'), store.column('cat_main')
+    pipeline = Pipeline([
+        ('vect', CountVectorizer(ngram_range=(1, 2))),
+        ('tfidf', TfidfTransformer()),
+        ('kbest', SelectKBest(chi2, k=10000)),
+        ('SGD', SGDClassifier(loss='modified_huber', tol=1e-3)),
+    ])
+    pipeline.fit(texts, labels)
+    return len(texts)
+
+
+def fit_streaming(path):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDClassifier
+
+    from benchmarks.utils import load_script
+
+    streaming = load_script('3_train_streaming.py')
+    vectorizer = HashingVectorizer(n_features=2 ** 22, ngram_range=(1, 2), alternate_sign=False, norm='l2')
+    streaming.train_streaming(path, 'cat_main', vectorizer, SGDClassifier(loss='modified_huber'), test_size=0.0)
+    return len(ShardStore(path))
+
+
+def run(name, path, queue):
+    func = globals()[name]
+    t0 = time.time()
+    nb_docs = func(path)
+    elapsed = time.time() - t0
+    queue.put((nb_docs / elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+
+if __name__ == '__main__':
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'dataset')
+        write_dataset(path, nb_docs)
+
+        context = multiprocessing.get_context('spawn')
+        for name in ('fit_in_memory', 'fit_streaming'):
+            queue = context.Queue()
+            process = context.Process(target=run, args=(name, path, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print("%-14s failed" % name)
+                continue
+            docs_per_second, peak_mb = queue.get()
+            print("%-14s %10.0f docs/s   peak RSS %8.1f MB" % (name, docs_per_second, peak_mb))
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,55 @@
+"""Load test for 5_serve.py: p50/p99 latency and requests/s.
+
+    python 5_serve.py &
+    python -m benchmarks.bench_serve --concurrency 16 --requests 2000
+"""
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+from benchmarks.utils import synthetic_text
+
+
+def worker(url, texts_per_request, nb_requests, latencies, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    for _ in range(nb_requests):
+        body = {'texts': [synthetic_text(rng, 150) for _ in range(texts_per_request)]}
+        t0 = time.perf_counter()
+        response = session.post(url, json=body)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - t0)
+
+
+def percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000, help='total number of requests')
+    parser.add_argument('--texts-per-request', type=int, default=1)
+    args = parser.parse_args()
+
+    latencies = []
+    per_thread = args.requests // args.concurrency
+    threads = [threading.Thread(target=worker, args=(args.url + '/predict', args.texts_per_request, per_thread,
+                                                     latencies, seed))
+               for seed in range(args.concurrency)]
+
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    print("%d requests in %0.3fs: %0.1f requests/s" % (len(latencies), elapsed, len(latencies) / elapsed))
+    print("p50 %0.2f ms   p99 %0.2f ms" % (percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3))
+    print(requests.get(args.url + '/health').json())
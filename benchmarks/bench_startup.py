@@ -0,0 +1,196 @@
+"""Cold start of the inference entry point, in fresh interpreters.
+
+    python -m benchmarks.bench_startup [nb_runs] [reference]
+
+Runs the startup path of 4_test.py (imports, loading the model from the
+registry, first prediction of a raw post) in the current tree and in the
+reference revision, by default the last one loading NLTK at import time, and
+then times the import of preprocessing and inference and the first
+clean_text call with and without a lemma table built from a synthetic
+corpus. Without the table the first call loads the NLTK corpora (and needs
+their data); with it and the fast engine, known tokens never touch NLTK.
+"""
+import json
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+from sklearn.externals import joblib
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.feature_selection import SelectKBest, chi2
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from benchmarks.utils import ROOT, synthetic_abstract
+from preprocessing import FAST_TOKEN_RE, TextCleaner, clean_texts, save_lemma_table
+
+# Last revision importing NLTK with preprocessing
+REFERENCE = '149b817'
+
+# Legacy pickles 4_test.py imports into the registry on its first run
+LEGACY_VERSION = '20180423-234137'
+
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+import preprocessing
+t1 = time.perf_counter()
+import inference
+t2 = time.perf_counter()
+preprocessing.init_worker(engine=sys.argv[1], lemma_table=sys.argv[2] or None)
+result = preprocessing.clean_text(sys.argv[3])
+t3 = time.perf_counter()
+print(json.dumps({'import_preprocessing': t1 - t0, 'import_inference': t2 - t1, 'first_clean': t3 - t2,
+                  'nltk_imported': 'nltk' in sys.modules}))
+'''
+
+# Startup of 4_test.py, run from a workspace holding ./files/models/ with the tree to test in front of sys.path
+CHILD_4TEST = '''
+import inspect, json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from inference import get_class_name_from_proba
+from instrumentation import metrics
+from model_registry import ModelRegistry
+import preprocessing
+t1 = time.perf_counter()
+
+registry = ModelRegistry('./files/models/registry/')
+if not registry.versions('cat_main'):
+    registry.import_legacy('./files/models/', 'cat_main', sys.argv[3])
+predictor = registry.load('cat_main', 'latest', compact=True)
+t2 = time.perf_counter()
+
+result = {'imports': t1 - t0, 'load_model': t2 - t1, 'compact': type(predictor.estimator).__name__ == 'CompactModel'}
+try:
+    kwargs = {'engine': sys.argv[2]}
+    if 'lemma_table' in inspect.signature(preprocessing.init_worker).parameters:
+        kwargs['lemma_table'] = './files/processed/lemmas.json'
+    preprocessing.init_worker(**kwargs)
+    proba = predictor.estimator.predict_proba([preprocessing.clean_text(sys.argv[4])])
+    get_class_name_from_proba(proba, predictor.class_list)
+    result['first_prediction'] = time.perf_counter() - t2
+except LookupError as e:
+    lines = [line.strip() for line in str(e).splitlines() if line.strip().strip('*')]
+    result['error'] = next((line for line in lines if line.startswith('Resource')), lines[-1])
+result['nltk_imported'] = 'nltk' in sys.modules
+print(json.dumps(result))
+'''
+
+
+def run_child(engine, lemma_table, text):
+    process = subprocess.run([sys.executable, '-c', CHILD, engine, lemma_table or '', text], cwd=ROOT,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        lines = [line.strip() for line in process.stderr.splitlines() if line.strip().strip('*')]
+        return {'error': next((line for line in lines if line.startswith('Resource')), lines[-1])}
+    return json.loads(process.stdout)
+
+
+def run_4test(tree, workspace, engine, text):
+    t0 = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', CHILD_4TEST, tree, engine, LEGACY_VERSION, text], cwd=workspace,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError(process.stderr)
+    result = json.loads(process.stdout)
+    result['process'] = time.perf_counter() - t0
+    return result
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def save_identity_table(filename, corpus):
+    """Lemma table mapping every token of the corpus to itself, without stopwords (no NLTK data needed)"""
+
+    table = str.maketrans('', '', string.punctuation)
+    tokens = (token.translate(table) for doc in corpus for token in FAST_TOKEN_RE.sub(r' \1 ', doc.lower()).split())
+    save_lemma_table(filename, {token: token for token in tokens if token.isalpha()}, set())
+
+
+def make_workspace(path, corpus, lemma_table):
+    """Folder laid out as 4_test.py expects it: legacy model pickles and the lemma table"""
+
+    os.makedirs(os.path.join(path, 'files', 'models'))
+    os.makedirs(os.path.join(path, 'files', 'processed'))
+    texts = list(clean_texts(corpus, n_jobs=1, engine='fast', lemma_table=lemma_table))
+    classList = ['class_%d' % i for i in range(4)]
+    pipeline = Pipeline([
+        ('vect', CountVectorizer(ngram_range=(1, 2))),
+        ('tfidf', TfidfTransformer()),
+        ('kbest', SelectKBest(chi2, k=500)),
+        ('SGD', SGDClassifier(loss='modified_huber', random_state=0)),
+    ]).fit(texts, [i % len(classList) for i in range(len(texts))])
+    suffix = 'cat_main_' + LEGACY_VERSION + '.pkl'
+    joblib.dump(pipeline, os.path.join(path, 'files', 'models', 'estimator_' + suffix))
+    joblib.dump(classList, os.path.join(path, 'files', 'models', 'classlist_' + suffix))
+    shutil.copy(lemma_table, os.path.join(path, 'files', 'processed', 'lemmas.json'))
+
+
+if __name__ == '__main__':
+    nb_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    reference = sys.argv[2] if len(sys.argv) > 2 else REFERENCE
+    rng = random.Random(0)
+    corpus = [synthetic_abstract(rng, 6) for _ in range(2000)]
+    text = corpus[0]
+
+    path = tempfile.mkdtemp()
+    lemma_table = os.path.join(path, 'lemmas.json')
+    try:
+        # Lemma table of the corpus, as 2_create_dataset.py writes it
+        try:
+            cleaner = TextCleaner(engine='fast')
+            cleaner.new_lemmas = {}
+            for doc in corpus:
+                cleaner.clean(doc)
+            save_lemma_table(lemma_table, cleaner.new_lemmas, cleaner.stop_words)
+        except LookupError:
+            print("NLTK data not installed: the lemma table maps each token to itself\n")
+            save_identity_table(lemma_table, corpus)
+
+        # Reference tree extracted next to the current one, each with its own workspace
+        trees = (('reference ' + reference, os.path.join(path, 'reference')), ('current', ROOT))
+        os.makedirs(trees[0][1])
+        archive = subprocess.run(['git', 'archive', reference], cwd=ROOT, stdout=subprocess.PIPE, check=True)
+        subprocess.run(['tar', '-x', '-C', trees[0][1]], input=archive.stdout, check=True)
+
+        template = os.path.join(path, 'workspace')
+        make_workspace(template, corpus, lemma_table)
+
+        print("4_test.py startup, median of %d runs after a first run importing the model:" % nb_runs)
+        for engine in ('nltk', 'fast'):
+            for name, tree in trees:
+                workspace = os.path.join(path, 'workspace_%s_%s' % (engine, os.path.basename(tree)))
+                shutil.copytree(template, workspace)
+                run_4test(tree, workspace, engine, text)
+                runs = [run_4test(tree, workspace, engine, text) for _ in range(nb_runs)]
+                line = "%-5s %-20s process %6.3fs   imports %6.3fs   load model %6.3fs (compact: %s)" % (
+                    engine, name, median([r['process'] for r in runs]), median([r['imports'] for r in runs]),
+                    median([r['load_model'] for r in runs]), runs[0]['compact'])
+                if 'error' in runs[0]:
+                    print(line + "   first prediction: " + runs[0]['error'])
+                else:
+                    print(line + "   first prediction %6.3fs   nltk imported: %s" % (
+                        median([r['first_prediction'] for r in runs]), runs[0]['nltk_imported']))
+
+        print("\nCleaning only, current tree:")
+        for engine in ('nltk', 'fast'):
+            for name, table in (('no table', None), ('lemma table', lemma_table)):
+                runs = [run_child(engine, table, text) for _ in range(nb_runs)]
+                errors = [run['error'] for run in runs if 'error' in run]
+                if errors:
+                    print("%-5s %-12s %s" % (engine, name, errors[0]))
+                    continue
+                print("%-5s %-12s import preprocessing %6.3fs   import inference %6.3fs   first clean %6.3fs"
+                      "   nltk imported: %s" % (engine, name, median([r['import_preprocessing'] for r in runs]),
+                                                median([r['import_inference'] for r in runs]),
+                                                median([r['first_clean'] for r in runs]), runs[0]['nltk_imported']))
+    finally:
+        shutil.rmtree(path)
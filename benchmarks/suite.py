@@ -0,0 +1,304 @@
+"""Benchmark of every pipeline stage on a synthetic corpus, with JSON results.
+
+    python -m benchmarks.suite [--docs N] [--output results.json] [--compare baseline.json]
+
+Stages: Atom parsing, text cleaning, dataset build, dataset sampling, fit of
+each pipeline step and single/batched prediction. Times are the best of at
+least --repeat runs lasting MIN_TIME seconds in total, so that short measures
+are repeated enough to be stable; latencies are the best of --repeat passes,
+per document. Metric names end with their unit: '_per_s' is better when
+higher, '_s' and '_ms' when lower, anything else is informational.
+
+With --compare, metrics are compared with a previous output file and the
+exit status is 1 when one of them regressed by more than --threshold (10%
+by default). Compare runs made on the same idle machine: the millisecond
+measures follow the machine's load as a block.
+Stages needing the NLTK data report an error instead of results when it is
+not installed.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from xml.etree import ElementTree
+
+import numpy as np
+import sklearn
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.feature_selection import SelectKBest, chi2
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from benchmarks.utils import load_script, synthetic_abstract, synthetic_corpus, synthetic_feed, timed
+from compact_model import CompactModel, export_compact
+from dedup import DedupIndex
+from preprocessing import TextCleaner
+from shard_store import PROCESSED_COLUMNS, ChunkWriter, ShardStore
+
+CATEGORIES = ('Physics', 'Mathematics', 'Computer Science', 'Statistics')
+
+# Seconds a measure is repeated for at least, whatever --repeat
+MIN_TIME = 1.0
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """Run func at least repeat times and MIN_TIME seconds, return (last result, shortest time in seconds)"""
+
+    times = []
+    while len(times) < repeat or sum(times) < MIN_TIME:
+        result, elapsed = timed(func, *args, **kwargs)
+        times.append(elapsed)
+    return result, min(times)
+
+
+def raw_records(nb_docs, seed):
+    rng = random.Random(seed)
+    for i in range(nb_docs):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        yield {'id': '1804.%05dv1' % i, 'title': synthetic_abstract(rng, 1), 'sum': synthetic_abstract(rng, 6),
+               'cat_main': category, 'cat_sub': category[:4].lower()}
+
+
+def bench_atom(config):
+    parser = load_script('1_get_data_arxiv.py')
+    feed = synthetic_feed(config['docs'], config['seed'])
+
+    entries, tree_time = best_of(config['repeat'], lambda: parser.get_entries(ElementTree.fromstring(feed),
+                                                                              'Computer Science'))
+    _, stream_time = best_of(config['repeat'], lambda: list(parser.iter_entries(io.BytesIO(feed),
+                                                                                'Computer Science')))
+    return {'entries': len(entries),
+            'get_entries_per_s': len(entries) / tree_time,
+            'iter_entries_per_s': len(entries) / stream_time}
+
+
+def bench_clean(config):
+    rng = random.Random(config['seed'])
+    docs = [synthetic_abstract(rng, 6) for _ in range(min(config['docs'], 5000))]
+
+    result = {'docs': len(docs)}
+    for engine in ('nltk', 'fast'):
+        cleaner = TextCleaner(engine=engine)
+        cleaner.clean(docs[0])
+        _, cold = timed(lambda: [cleaner.clean(doc) for doc in docs])
+        _, warm = best_of(config['repeat'], lambda: [cleaner.clean(doc) for doc in docs])
+        result[engine + '_cold_docs_per_s'] = len(docs) / cold
+        result[engine + '_warm_docs_per_s'] = len(docs) / warm
+    return result
+
+
+def bench_build(config):
+    create_dataset = load_script('2_create_dataset.py')
+    path = tempfile.mkdtemp()
+    try:
+        store = ShardStore(os.path.join(path, 'raw'))
+        records = list(raw_records(config['docs'], config['seed']))
+        for start in range(0, len(records), 1000):
+            store.append('page_%d' % start, records[start:start + 1000])
+
+        def build():
+            dataset = ShardStore(os.path.join(path, 'dataset'), columns=PROCESSED_COLUMNS)
+            dataset.clear()
+            index = DedupIndex(os.path.join(path, 'dedup'))
+            index.clear()
+            with ChunkWriter(dataset, chunk_size=config['docs'] // 4 or 1) as writer, \
+                    redirect_stdout(io.StringIO()):  # iter_shard_records prints the shard names
+                records = create_dataset.clean_records(create_dataset.iter_shard_records(store, store.names(), index),
+                                                       n_jobs=config['n_jobs'], engine=config['engine'])
+                for record in create_dataset.drop_near_duplicates(records, index):
+                    writer.write(record)
+            return len(dataset)
+
+        nb_records, elapsed = best_of(config['repeat'], build)
+    finally:
+        shutil.rmtree(path)
+    return {'records': nb_records, 'build_s': elapsed, 'build_records_per_s': nb_records / elapsed}
+
+
+def bench_sample(config):
+    gridsearch = load_script('3_gridsearch.py')
+    texts, labels = synthetic_corpus(config['docs'], nb_classes=len(CATEGORIES), seed=config['seed'])
+    path = tempfile.mkdtemp()
+    try:
+        dataset = ShardStore(path, columns=PROCESSED_COLUMNS)
+        with ChunkWriter(dataset, chunk_size=config['docs'] // 4 or 1) as writer:
+            for i, (text, label) in enumerate(zip(texts, labels)):
+                writer.write({'id': str(i), 'title': text[:40], 'sum': text, 'input': text,
+                              'cat_main': CATEGORIES[int(label[-1])], 'cat_sub': label})
+
+        per_cat = config['docs'] // (2 * len(CATEGORIES))
+        with redirect_stdout(io.StringIO()):  # open_dataset prints the category counts
+            data, elapsed = best_of(config['repeat'], gridsearch.open_dataset, path, 'cat_main', per_cat,
+                                    seed=config['seed'])
+    finally:
+        shutil.rmtree(path)
+    return {'rows': len(data), 'open_dataset_s': elapsed}
+
+
+def fit_pipeline(config):
+    texts, labels = synthetic_corpus(config['docs'], nb_classes=len(CATEGORIES), seed=config['seed'])
+    classList = sorted(set(labels))
+    y = np.array([classList.index(label) for label in labels])
+    steps = [('vect', CountVectorizer(max_df=0.9, ngram_range=(1, 2))),
+             ('tfidf', TfidfTransformer()),
+             ('kbest', SelectKBest(chi2, k=min(5000, config['docs'] * 10))),
+             ('SGD', SGDClassifier(loss='modified_huber', alpha=0.00001, random_state=config['seed']))]
+    return Pipeline(steps), texts, y, classList
+
+
+def bench_fit(config):
+    pipeline, texts, y, _ = fit_pipeline(config)
+    result = {}
+    X = texts
+    for name, step in pipeline.steps:
+        if name == 'SGD':
+            _, elapsed = best_of(config['repeat'], step.fit, X, y)
+        else:
+            X, elapsed = best_of(config['repeat'], step.fit_transform, X, y)
+        result[name + '_fit_s'] = elapsed
+    result['features'] = X.shape[1]
+    return result
+
+
+def latencies_ms(func, batches):
+    values = []
+    for batch in batches:
+        t0 = time.perf_counter()
+        func(batch)
+        values.append((time.perf_counter() - t0) * 1e3)
+    return np.array(values)
+
+
+def bench_predict(config):
+    pipeline, texts, y, classList = fit_pipeline(config)
+    pipeline.fit(texts, y)
+    docs = texts[:min(len(texts), 1000)]
+    single_docs = docs[:200]
+    batch_size = 256
+
+    result = {}
+    path = tempfile.mkdtemp()
+    try:
+        export_compact(pipeline, classList, path)
+        for name, model in (('pipeline', pipeline), ('compact', CompactModel.load(path))):
+            # Best latency of each document over the passes, then its percentiles
+            single = np.min([latencies_ms(model.predict_proba, [[doc] for doc in single_docs])
+                             for _ in range(config['repeat'])], axis=0)
+            _, batched = best_of(config['repeat'], latencies_ms, model.predict_proba,
+                                 [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)])
+            result[name + '_single_p50_ms'] = float(np.percentile(single, 50))
+            result[name + '_single_p99_ms'] = float(np.percentile(single, 99))
+            result[name + '_batched_per_doc_ms'] = 1e3 * batched / len(docs)
+    finally:
+        shutil.rmtree(path)
+    return result
+
+
+STAGES = OrderedDict([
+    ('atom', bench_atom),
+    ('clean', bench_clean),
+    ('build', bench_build),
+    ('sample', bench_sample),
+    ('fit', bench_fit),
+    ('predict', bench_predict),
+])
+
+
+def run(stages, config):
+    """Run the stages, a failing stage is reported and the next one started
+
+    Arguments:
+        stages {list}   -- stage names
+        config {dict}   -- docs, seed, repeat, n_jobs, engine
+
+    Returns:
+        [dict] -- meta and results, JSON serializable
+    """
+
+    results = OrderedDict()
+    for name in stages:
+        print("%s..." % name, end=' ', flush=True)
+        t0 = time.time()
+        try:
+            results[name] = STAGES[name](config)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {'error': '%s: %s' % (type(e).__name__, e)}
+        print("%0.1fs" % (time.time() - t0))
+
+    meta = dict(config, created=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                numpy=np.__version__, sklearn=sklearn.__version__, machine=platform.machine(),
+                cpu_count=os.cpu_count())
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold):
+    """Print the relative change of every metric found in both runs
+
+    Arguments:
+        baseline {dict}     -- previous output
+        current {dict}      -- new output
+        threshold {float}   -- relative change counted as a regression (ex: 0.1)
+
+    Returns:
+        [list] -- (stage, metric, change) of the regressions
+    """
+
+    regressions = []
+    for stage, metrics in current['results'].items():
+        previous = baseline['results'].get(stage, {})
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            if metric.endswith('_per_s'):
+                regressed = change < -threshold
+            elif metric.endswith('_s') or metric.endswith('_ms'):
+                regressed = change > threshold
+            else:
+                continue
+            print("%-8s %-28s %12.4g -> %12.4g  %+7.1f%%%s" % (stage, metric, old, value, 100 * change,
+                                                            '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((stage, metric, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--docs', type=int, default=5000, help='size of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measure, the best one is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-jobs', type=int, default=2, help='cleaning processes of the build stage')
+    parser.add_argument('--engine', default='nltk', help='cleaning engine of the build stage')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='previous JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    config = {'docs': args.docs, 'repeat': args.repeat, 'seed': args.seed, 'n_jobs': args.n_jobs,
+              'engine': args.engine}
+    output = run(args.stages, config)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), output, args.threshold)
+        sys.exit(1 if regressions else 0)
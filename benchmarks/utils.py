@@ -0,0 +1,132 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks are run from the repository root, e.g.:
+
+    python -m benchmarks.bench_atom_parser
+"""
+import importlib.util
+import os
+import random
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ('model network learning data graph quantum field energy theory algorithm optimal random matrix '
+         'protein cell gene market price risk signal system control estimation sample method result '
+         'analysis problem function space group finite linear neural deep image language time series').split()
+
+
+def load_script(filename):
+    """Import one of the numbered pipeline scripts (ex: 1_get_data_arxiv.py)
+
+    Arguments:
+        filename {text} -- script filename, relative to the repository root
+
+    Returns:
+        [module] -- loaded module, its __main__ block is not executed
+    """
+
+    name = os.path.splitext(filename)[0].lstrip('0123456789_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_text(rng, nb_words):
+    """Random sentence-like text made of a small scientific vocabulary"""
+
+    words = [rng.choice(WORDS) for _ in range(nb_words)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def synthetic_abstract(rng, nb_sentences):
+    """Abstract-like text with the punctuation, contractions and numbers of real posts"""
+
+    extras = ["(see Sec. 3)", "state-of-the-art", "don't", "it's", "e.g.", "U.S.", "10.1%", "$O(n^2)$",
+              "[12]", "\"robust\"", "cannot", "x*y", "and/or", "we'll", "--", "...", "v2.0", "world’s",
+              "“fast”", "a–b", "Fig. 2:", "i.e.,", "#tag", "Q&A", "email@example.org"]
+    sentences = []
+    for _ in range(nb_sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 25))]
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randrange(len(words)), rng.choice(extras))
+        sentences.append(' '.join(words).capitalize() + rng.choice('.?!'))
+    return ' '.join(sentences)
+
+
+def synthetic_feed(nb_entries, seed=0):
+    """Build an arXiv-like Atom feed
+
+    Arguments:
+        nb_entries {int} -- number of entries
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        [bytes] -- Atom document
+    """
+
+    rng = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom">'
+             '<title>ArXiv Query</title>']
+    for i in range(nb_entries):
+        parts.append('<entry><id>http://arxiv.org/abs/1804.%05dv1</id>'
+                     '<updated>2018-04-23T00:00:00Z</updated>'
+                     '<title>%s</title><summary>%s\n%s</summary>'
+                     '<author><name>A. Author</name></author>'
+                     '<arxiv:primary_category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>'
+                     '<category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>'
+                     '</entry>' % (i, synthetic_text(rng, 8), synthetic_text(rng, 80), synthetic_text(rng, 60)))
+    parts.append('</feed>')
+    return ''.join(parts).encode('utf-8')
+
+
+def synthetic_corpus(nb_docs, nb_classes=4, nb_words=120, vocabulary_size=20000, seed=0):
+    """Cleaned-looking documents whose word distribution depends on their class
+
+    Words follow a Zipf law over a pseudo-word vocabulary; each class draws a
+    share of its words from its own slice of the vocabulary so that the
+    classifiers have something to learn.
+
+    Arguments:
+        nb_docs {int} -- number of documents
+
+    Keyword Arguments:
+        nb_classes {int}        -- number of classes (default: {4})
+        nb_words {int}          -- words per document (default: {120})
+        vocabulary_size {int}   -- number of distinct words (default: {20000})
+        seed {int}              -- random seed (default: {0})
+
+    Returns:
+        [tuple] -- (list of texts, list of class names)
+    """
+
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    vocabulary = np.array([''.join(rng.choice(letters, rng.randint(3, 10))) for _ in range(vocabulary_size)])
+    weights = 1.0 / np.arange(1, vocabulary_size + 1)
+    weights /= weights.sum()
+    class_words = np.array_split(rng.permutation(vocabulary_size), nb_classes)
+
+    texts, labels = [], []
+    for i in range(nb_docs):
+        label = i % nb_classes
+        words = vocabulary[rng.choice(vocabulary_size, nb_words, p=weights)]
+        specific = rng.rand(nb_words) < 0.2
+        words[specific] = vocabulary[rng.choice(class_words[label], specific.sum())]
+        texts.append(' '.join(words))
+        labels.append('class_%d' % label)
+    return texts, labels
+
+
+def timed(func, *args, **kwargs):
+    """Call func and return (result, elapsed seconds)"""
+
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
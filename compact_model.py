@@ -0,0 +1,326 @@
+"""Compact export of the fitted vect -> tfidf -> kbest -> SGD pipeline.
+
+A pickled Pipeline keeps the whole CountVectorizer vocabulary (and its
+stop_words_ set) although SelectKBest only keeps k features. The export keeps
+the selected terms only and stores the model in a folder::
+
+    meta.json        -- vectorizer / tf-idf settings, loss, classes
+    vocabulary.txt   -- selected terms, one per line, in feature order
+    idf.npy          -- idf weights of the selected terms (if use_idf)
+    coef.npy         -- SGD coefficients (n_classes x k)
+    intercept.npy    -- SGD intercepts
+    dropped_hashes.npy  -- sorted 64-bit hashes of the terms SelectKBest dropped (if norm)
+    dropped_idf.npy     -- index of their idf weight in idf_values.npy
+    idf_values.npy      -- distinct idf weights of the dropped terms
+
+Arrays are saved uncompressed and memory-mapped on load. The pipeline
+normalises the tf-idf rows over the whole vocabulary before the selection, so
+the dropped terms are kept as hashes only, to add their weight to the norm.
+Probabilities match the ones of the pipeline to float precision. That table
+takes about 10 bytes per dropped term and makes most of the folder: with a
+norm the export is only a few times smaller than the pickle, without one
+(norm=None) it is not written and the folder holds the kept terms only.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+# CountVectorizer settings needed to rebuild the analyzer
+VECTORIZER_PARAMS = ('analyzer', 'binary', 'lowercase', 'ngram_range', 'strip_accents', 'token_pattern',
+                     'stop_words')
+
+
+def term_hashes(terms):
+    """Stable 64-bit hashes of terms
+
+    Arguments:
+        terms {list} -- terms
+
+    Returns:
+        [array] -- uint64 hashes
+    """
+
+    return np.array([int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for term in terms], dtype=np.uint64)
+
+
+def is_exportable(pipeline):
+    """Whether a fitted estimator can be exported by export_compact
+
+    Arguments:
+        pipeline {object} -- fitted estimator
+
+    Returns:
+        [bool] -- True for a pipeline with vect (with a vocabulary), tfidf and SGD steps
+    """
+
+    steps = getattr(pipeline, 'named_steps', {})
+    return all(name in steps for name in ('vect', 'tfidf', 'SGD')) and hasattr(steps['vect'], 'vocabulary_')
+
+
+def export_compact(pipeline, class_list, path, check_texts=None, tolerance=1e-9):
+    """Write a fitted pipeline as a compact model folder
+
+    Arguments:
+        pipeline {Pipeline} -- fitted pipeline with vect, tfidf, kbest (optional) and SGD steps
+        class_list {list}   -- class names, in the order of the encoded labels
+        path {text}         -- model folder, created if needed
+
+    Keyword Arguments:
+        check_texts {list}  -- clean texts the compact model must score as the pipeline does (default: {None})
+        tolerance {float}   -- largest difference allowed on the scores of check_texts (default: {1e-9})
+
+    Raises:
+        ValueError -- the compact model disagrees with the pipeline, the folder is removed
+
+    Returns:
+        [int] -- number of features kept
+    """
+
+    steps = pipeline.named_steps
+    vect, tfidf, clf = steps['vect'], steps['tfidf'], steps['SGD']
+
+    # Feature order after selection: rank of the term among the kept columns
+    nb_features = len(vect.vocabulary_)
+    support = steps['kbest'].get_support() if 'kbest' in steps else np.ones(nb_features, dtype=bool)
+    terms = np.empty(nb_features, dtype=object)
+    for term, index in vect.vocabulary_.items():
+        terms[index] = term
+    dropped = terms[~support]
+    terms = terms[support]
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    with open(os.path.join(path, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(terms))
+    if tfidf.use_idf:
+        np.save(os.path.join(path, 'idf.npy'), tfidf.idf_[support])
+    if tfidf.norm:
+        # Dropped terms still count in the norm: hash -> idf, sorted for a binary search
+        hashes = term_hashes(dropped)
+        order = np.argsort(hashes)
+        dropped_idf = tfidf.idf_[~support][order] if tfidf.use_idf else np.ones(len(dropped))
+        idf_values, idf_index = np.unique(dropped_idf, return_inverse=True)
+        np.save(os.path.join(path, 'dropped_hashes.npy'), hashes[order])
+        np.save(os.path.join(path, 'dropped_idf.npy'),
+                idf_index.astype(np.min_scalar_type(max(len(idf_values) - 1, 0))))
+        np.save(os.path.join(path, 'idf_values.npy'), idf_values)
+    np.save(os.path.join(path, 'coef.npy'), np.ascontiguousarray(clf.coef_))
+    np.save(os.path.join(path, 'intercept.npy'), clf.intercept_)
+
+    vect_params = vect.get_params()
+    meta = {
+        'vectorizer': {name: vect_params[name] for name in VECTORIZER_PARAMS},
+        'tfidf': {'norm': tfidf.norm, 'use_idf': tfidf.use_idf, 'sublinear_tf': tfidf.sublinear_tf},
+        'loss': clf.loss,
+        'classes': clf.classes_.tolist(),
+        'class_list': list(class_list),
+    }
+    if isinstance(meta['vectorizer']['stop_words'], frozenset):
+        meta['vectorizer']['stop_words'] = sorted(meta['vectorizer']['stop_words'])
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    if check_texts is not None and len(check_texts):
+        compact = CompactModel.load(path)
+        if clf.loss in ('log', 'log_loss', 'modified_huber'):
+            expected, scores = pipeline.predict_proba(check_texts), compact.predict_proba(check_texts)
+        else:
+            expected, scores = pipeline.decision_function(check_texts), compact.decision_function(check_texts)
+        difference = float(np.abs(expected - scores).max())
+        if difference > tolerance:
+            shutil.rmtree(path)
+            raise ValueError("compact model disagrees with the pipeline (max difference %g)" % difference)
+
+    return len(terms)
+
+
+class CompactModel(object):
+    """Model loaded from a compact folder, usable wherever the pipeline's predict_proba is"""
+
+    def __init__(self, meta, terms, idf, coef, intercept, dropped_hashes=None, dropped_idf=None, idf_values=None):
+        self.meta = meta
+        self.class_list = meta['class_list']
+        self.classes_ = np.array(meta['classes'])
+        vect_params = dict(meta['vectorizer'], ngram_range=tuple(meta['vectorizer']['ngram_range']))
+        self.vectorizer = CountVectorizer(vocabulary={term: i for i, term in enumerate(terms)}, **vect_params)
+        self.vocabulary = self.vectorizer.vocabulary
+        self.analyzer = self.vectorizer.build_analyzer()
+        self.idf = idf
+        self.coef = coef
+        self.intercept = intercept
+        self.dropped_hashes = dropped_hashes
+        self.dropped_idf = dropped_idf
+        self.idf_values = idf_values
+
+    @classmethod
+    def load(cls, path):
+        """Load a folder written by export_compact, arrays are memory-mapped
+
+        Arguments:
+            path {text} -- model folder
+
+        Returns:
+            [CompactModel] -- model
+        """
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'vocabulary.txt'), encoding='utf-8') as f:
+            terms = f.read().split('\n')
+
+        idf = None
+        if meta['tfidf']['use_idf']:
+            idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode='r')
+        coef = np.load(os.path.join(path, 'coef.npy'), mmap_mode='r')
+        intercept = np.load(os.path.join(path, 'intercept.npy'), mmap_mode='r')
+        dropped = [None] * 3
+        if meta['tfidf']['norm']:
+            dropped = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                       for name in ('dropped_hashes', 'dropped_idf', 'idf_values')]
+        return cls(meta, terms, idf, coef, intercept, *dropped)
+
+    def term_weights(self, counts):
+        """Tf weights of term counts, as the vectorizer and TfidfTransformer compute them"""
+
+        counts = counts.astype(np.float64)
+        if self.meta['vectorizer']['binary']:
+            counts[:] = 1
+        if self.meta['tfidf']['sublinear_tf']:
+            np.log(counts, counts)
+            counts += 1
+        return counts
+
+    def dropped_norm(self, counter):
+        """Part of the norm of a text due to the terms SelectKBest dropped
+
+        Arguments:
+            counter {Counter} -- counts of the terms of the text missing from the selected terms
+
+        Returns:
+            [float] -- sum of the squared (l2) or absolute (l1) weights
+        """
+
+        if not counter or self.dropped_hashes is None or not len(self.dropped_hashes):
+            return 0.
+        hashes = term_hashes(list(counter))
+        index = np.minimum(np.searchsorted(self.dropped_hashes, hashes), len(self.dropped_hashes) - 1)
+        found = self.dropped_hashes[index] == hashes
+        if not found.any():
+            return 0.
+        weights = self.term_weights(np.fromiter(counter.values(), dtype=np.int64)[found])
+        weights *= np.asarray(self.idf_values)[np.asarray(self.dropped_idf)[index[found]]]
+        return float(np.sum(weights ** 2) if self.meta['tfidf']['norm'] == 'l2' else np.sum(np.abs(weights)))
+
+    def transform(self, texts):
+        """Tf-idf matrix of clean texts over the selected terms, normalised over the whole vocabulary
+
+        Arguments:
+            texts {list} -- clean texts
+
+        Returns:
+            [csr_matrix] -- n_texts x k
+        """
+
+        indptr, indices, counts, dropped_norms = [0], [], [], []
+        for text in texts:
+            kept, dropped = {}, Counter()
+            for term in self.analyzer(text):
+                index = self.vocabulary.get(term)
+                if index is None:
+                    dropped[term] += 1
+                else:
+                    kept[index] = kept.get(index, 0) + 1
+            indices.extend(kept)
+            counts.extend(kept.values())
+            indptr.append(len(indices))
+            dropped_norms.append(self.dropped_norm(dropped))
+
+        X = sparse.csr_matrix((self.term_weights(np.array(counts, dtype=np.int64)),
+                               np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                              shape=(len(indptr) - 1, len(self.vocabulary)))
+        X.sort_indices()
+        if self.idf is not None:
+            X = X * sparse.diags(np.asarray(self.idf))
+        norm = self.meta['tfidf']['norm']
+        if norm:
+            X = sparse.csr_matrix(X)
+            kept_norms = np.asarray((X.multiply(X) if norm == 'l2' else abs(X)).sum(axis=1)).ravel()
+            norms = kept_norms + np.array(dropped_norms)
+            if norm == 'l2':
+                norms = np.sqrt(norms)
+            norms[norms == 0] = 1
+            X = sparse.diags(1. / norms) @ X
+        return sparse.csr_matrix(X)
+
+    def decision_function(self, texts):
+        scores = self.transform(texts) @ np.asarray(self.coef).T + np.asarray(self.intercept)
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict_proba(self, texts):
+        """Class probabilities, computed as SGDClassifier does for the log and modified_huber losses
+
+        Arguments:
+            texts {list} -- clean texts
+
+        Returns:
+            [array] -- n_texts x n_classes
+        """
+
+        scores = self.decision_function(texts)
+        loss = self.meta['loss']
+
+        if loss in ('log', 'log_loss'):
+            prob = 1. / (1. + np.exp(-scores))
+        elif loss == 'modified_huber':
+            prob = (np.clip(scores, -1, 1) + 1) / 2.
+        else:
+            raise ValueError("probability estimates are not available for loss=" + loss)
+
+        if prob.ndim == 1:
+            return np.vstack([1 - prob, prob]).T
+
+        prob_sum = prob.sum(axis=1)
+        all_zero = prob_sum == 0
+        prob[all_zero] = 1
+        prob_sum[all_zero] = len(self.classes_)
+        return prob / prob_sum[:, np.newaxis]
+
+    def predict(self, texts):
+        scores = self.decision_function(texts)
+        indices = (scores > 0).astype(int) if scores.ndim == 1 else scores.argmax(axis=1)
+        return self.classes_[indices]
+
+
+if __name__ == '__main__':
+    import time
+
+    from sklearn.externals import joblib
+
+    # -------------------------------------------------------------------------
+    # PARAMETERS
+    # -------------------------------------------------------------------------
+
+    models_path = './files/models/'
+    model_name = 'cat_main_20180423-234137'
+
+    # -------------------------------------------------------------------------
+    # EXPORT
+    # -------------------------------------------------------------------------
+
+    pipeline = joblib.load(models_path + 'estimator_' + model_name + '.pkl')
+    classList = joblib.load(models_path + 'classlist_' + model_name + '.pkl')
+
+    nb_features = export_compact(pipeline, classList, models_path + 'compact_' + model_name)
+    print("%d features kept" % nb_features)
+
+    t0 = time.time()
+    CompactModel.load(models_path + 'compact_' + model_name)
+    print("loaded in %0.3fs" % (time.time() - t0))
@@ -0,0 +1,347 @@
+"""Duplicate detection of the harvested records.
+
+The harvester queries overlapping categories (cond-mat*, physics*, quant-ph*
+all map to Physics) and papers come back in several versions, so the same
+paper may be stored many times. DedupIndex drops:
+
+    - exact duplicates: same arXiv id once the version suffix is removed
+      (1804.01234v2 -> 1804.01234)
+    - near duplicates: MinHash signature of the word n-grams of the cleaned
+      text close to the one of an indexed record (estimated Jaccard
+      similarity >= threshold)
+
+Near duplicates are looked up with LSH: the signature is cut into bands and
+only the records sharing at least one band are compared. Band keys are kept
+in a few sorted segments (binary search) plus a dict of the keys added since
+the last save, so a lookup stays logarithmic in the number of records.
+
+The index is stored in a folder and updated incrementally::
+
+    meta.json               -- parameters, counts, segments and drop statistics
+    ids.txt                 -- every id seen, one per line
+    rows.txt                -- id of each indexed record, in row order
+    signatures.<k>.npy      -- MinHash signatures of the rows added by save k
+    band_keys.<s>.npy       -- sorted band keys of segment s
+    band_rows.<s>.npy       -- row of each band key of segment s
+
+Each save writes its keys as a new segment; a segment is merged with the
+previous one as soon as it is at least half its size, so there are about
+log2(number of saves) segments and a key is rewritten O(log) times instead
+of on every save. Drop statistics are cumulative, clear() keeps them.
+"""
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+ARXIV_URL = 'http://arxiv.org/abs/'
+VERSION_RE = re.compile(r'v\d+$')
+
+# Prime of the FNV hash combining the values of a band
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# A band key segment is merged into the previous one when it reaches this share of its size
+MERGE_RATIO = 0.5
+
+
+def normalize_id(arxiv_id):
+    """arXiv id without url prefix and version suffix (ex: 1804.01234v2 -> 1804.01234)"""
+
+    return VERSION_RE.sub('', arxiv_id.replace(ARXIV_URL, ''))
+
+
+def get_shingles(text, size=3):
+    """Hashes of the distinct word n-grams of a text
+
+    Arguments:
+        text {text} -- clean text
+
+    Keyword Arguments:
+        size {int} -- number of words per n-gram (default: {3})
+
+    Returns:
+        [array] -- uint64 hashes, empty if the text has no word
+    """
+
+    words = text.split()
+    if 0 < len(words) < size:
+        size = len(words)
+    grams = {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)} if words else set()
+    return np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+
+
+class DedupIndex(object):
+    """Exact id and MinHash/LSH near-duplicate index, persisted in a folder"""
+
+    def __init__(self, path, num_perm=64, bands=16, threshold=0.8, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        self.path = path
+        self.meta_filename = os.path.join(path, 'meta.json')
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        params = {'num_perm': num_perm, 'bands': bands, 'threshold': threshold, 'shingle_size': shingle_size,
+                  'seed': seed}
+        meta = None
+        if os.path.exists(self.meta_filename):
+            with open(self.meta_filename) as f:
+                meta = json.load(f)
+            params = meta['params']  # signatures of the stored rows depend on them
+        self.params = params
+        self.num_perm = params['num_perm']
+        self.bands = params['bands']
+        self.threshold = params['threshold']
+        self.shingle_size = params['shingle_size']
+
+        # Multiply-shift hash functions: h(x) = (a * x + b) >> 32, on 64 bits
+        rng = np.random.RandomState(params['seed'])
+        self.a = (rng.randint(0, 1 << 62, self.num_perm, dtype=np.int64).astype(np.uint64) << np.uint64(1)) | \
+            np.uint64(1)
+        self.b = rng.randint(0, 1 << 62, self.num_perm, dtype=np.int64).astype(np.uint64)
+
+        self._load(meta)
+
+    def _load(self, meta, stats=None):
+        self.stats = {'records': 0, 'duplicate_ids': 0, 'near_duplicates': 0}
+        if stats is not None:
+            self.stats.update(stats, records=0)
+        self.ids = set()
+        self.row_ids = []
+        self.chunks = []  # signature arrays, memory-mapped once saved
+        self.offsets = [0]  # first row of each chunk
+        self.segments = []  # (segment number, sorted band keys, rows), memory-mapped
+        self.next_segment = 0
+        self.new_ids = []
+        self.new_signatures = []
+        self.new_bands = {}
+        if meta is None:
+            return
+
+        self.stats = meta['stats']
+        self.ids = set(self._read_lines('ids.txt', meta['nb_ids']))
+        self.row_ids = self._read_lines('rows.txt', meta['nb_rows'])
+        for k in range(meta['nb_chunks']):
+            chunk = np.load(os.path.join(self.path, 'signatures.%d.npy' % k), mmap_mode='r')
+            self.chunks.append(chunk)
+            self.offsets.append(self.offsets[-1] + len(chunk))
+        if 'band_segments' in meta:
+            self.next_segment = meta['next_segment']
+            self.segments = [self._load_segment(number) for number, _ in meta['band_segments']]
+        elif meta['nb_band_keys']:
+            # single band_keys.npy of the first versions, rewritten on every save
+            number, keys, rows = self._load_segment(-1)
+            if len(keys) != meta['nb_band_keys']:
+                # save interrupted before meta.json was written: drop the keys of the unsaved rows
+                kept = np.asarray(rows) < meta['nb_rows']
+                keys, rows = np.asarray(keys)[kept], np.asarray(rows)[kept]
+            self.segments = [(number, keys, rows)]
+
+    def _segment_filename(self, name, number):
+        return os.path.join(self.path, '%s.%d.npy' % (name, number) if number >= 0 else name + '.npy')
+
+    def _load_segment(self, number):
+        return (number, np.load(self._segment_filename('band_keys', number), mmap_mode='r'),
+                np.load(self._segment_filename('band_rows', number), mmap_mode='r'))
+
+    def _write_segment(self, keys, rows):
+        number = self.next_segment
+        self.next_segment += 1
+        order = np.argsort(keys, kind='mergesort')
+        np.save(self._segment_filename('band_keys', number), keys[order])
+        np.save(self._segment_filename('band_rows', number), rows[order])
+        return self._load_segment(number)
+
+    def _read_lines(self, filename, count):
+        # lines appended by an interrupted save are dropped, the next save appends after the kept ones
+        filename = os.path.join(self.path, filename)
+        if not os.path.exists(filename):
+            return []
+        with open(filename, encoding='utf-8') as f:
+            lines = f.read().split('\n')[:count]
+        if os.path.getsize(filename) != sum(len(line.encode('utf-8')) + 1 for line in lines):
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(''.join(line + '\n' for line in lines))
+        return lines
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @property
+    def nb_band_keys(self):
+        return sum(len(keys) for _, keys, _ in self.segments)
+
+    def clear(self):
+        """Remove every record of the index, its parameters and drop statistics are kept"""
+
+        for filename in os.listdir(self.path):
+            os.remove(os.path.join(self.path, filename))
+        self._load(None, stats=self.stats)
+
+    def add_id(self, arxiv_id):
+        """Register an arXiv id
+
+        Arguments:
+            arxiv_id {text} -- id, with or without version
+
+        Returns:
+            [bool] -- False if the id (any version) was already seen
+        """
+
+        key = normalize_id(arxiv_id)
+        if key in self.ids:
+            self.stats['duplicate_ids'] += 1
+            return False
+        self.ids.add(key)
+        self.new_ids.append(key)
+        return True
+
+    def signature(self, text):
+        """MinHash signature of the word n-grams of a text, None if it has no word
+
+        Arguments:
+            text {text} -- clean text
+
+        Returns:
+            [array] -- num_perm uint32 values
+        """
+
+        shingles = get_shingles(text, self.shingle_size)
+        if not len(shingles):
+            return None
+        hashes = (self.a[:, np.newaxis] * shingles[np.newaxis, :] + self.b[:, np.newaxis]) >> np.uint64(32)
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def get_band_keys(self, signature):
+        """One uint64 key per band of a signature, the band number is part of the key"""
+
+        values = signature.reshape(self.bands, -1).astype(np.uint64)
+        keys = np.arange(self.bands, dtype=np.uint64)
+        for column in values.T:
+            keys = (keys * FNV_PRIME) ^ column
+        return keys
+
+    def get_signature(self, row):
+        chunk = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        if chunk < len(self.chunks):
+            return self.chunks[chunk][row - self.offsets[chunk]]
+        return self.new_signatures[row - self.offsets[-1]]
+
+    def find_near_duplicate(self, signature, band_keys=None):
+        """Indexed row whose signature is the closest to a signature, above the threshold
+
+        Arguments:
+            signature {array} -- MinHash signature
+
+        Keyword Arguments:
+            band_keys {array} -- get_band_keys(signature), computed if None (default: {None})
+
+        Returns:
+            [int] -- row, None if no indexed record is similar enough
+        """
+
+        if band_keys is None:
+            band_keys = self.get_band_keys(signature)
+
+        candidates = set()
+        for _, keys, rows in self.segments:
+            positions = np.searchsorted(keys, band_keys)
+            for key, position in zip(band_keys, positions):
+                while position < len(keys) and keys[position] == key:
+                    candidates.add(int(rows[position]))
+                    position += 1
+        for key in band_keys:
+            candidates.update(self.new_bands.get(int(key), ()))
+
+        best, best_similarity = None, self.threshold
+        for row in candidates:
+            similarity = np.mean(self.get_signature(row) == signature)
+            if similarity >= best_similarity:
+                best, best_similarity = row, similarity
+        return best
+
+    def add_text(self, arxiv_id, text, check=True):
+        """Index the clean text of a record unless it is a near duplicate
+
+        Arguments:
+            arxiv_id {text} -- id of the record
+            text {text}     -- clean text (ex: the input column)
+
+        Keyword Arguments:
+            check {bool} -- look for near duplicates, False to index the record anyway (default: {True})
+
+        Returns:
+            [text] -- id of the indexed record it duplicates, None if it was indexed
+        """
+
+        signature = self.signature(text)
+        if signature is None:
+            signature = np.zeros(self.num_perm, dtype=np.uint32)
+            band_keys = None
+        else:
+            band_keys = self.get_band_keys(signature)
+            if check:
+                row = self.find_near_duplicate(signature, band_keys)
+                if row is not None:
+                    self.stats['near_duplicates'] += 1
+                    return self.row_ids[row]
+
+        row = len(self.row_ids)
+        self.row_ids.append(normalize_id(arxiv_id))
+        self.new_signatures.append(signature)
+        if band_keys is not None:  # texts without words are never matched
+            for key in band_keys:
+                self.new_bands.setdefault(int(key), []).append(row)
+        self.stats['records'] += 1
+        return None
+
+    def save(self):
+        """Write the records added since the last save, meta.json last"""
+
+        nb_chunks = len(self.chunks)
+        if self.new_signatures:
+            filename = os.path.join(self.path, 'signatures.%d.npy' % nb_chunks)
+            np.save(filename, np.array(self.new_signatures, dtype=np.uint32))
+            self.chunks.append(np.load(filename, mmap_mode='r'))
+            self.offsets.append(self.offsets[-1] + len(self.new_signatures))
+            nb_chunks += 1
+
+        # New keys become a segment, merged with the previous ones while they are of comparable size.
+        # Segments are never modified, the ones replaced by a merge are removed once meta.json is written.
+        previous_segments = [number for number, _, _ in self.segments]
+        if self.new_bands:
+            new_keys = np.fromiter((key for key, rows in self.new_bands.items() for _ in rows), dtype=np.uint64)
+            new_rows = np.fromiter((row for rows in self.new_bands.values() for row in rows), dtype=np.uint32)
+            while self.segments and len(new_keys) >= MERGE_RATIO * len(self.segments[-1][1]):
+                _, keys, rows = self.segments.pop()
+                new_keys = np.concatenate([keys, new_keys])
+                new_rows = np.concatenate([rows, new_rows])
+            self.segments.append(self._write_segment(new_keys, new_rows))
+
+        new_rows = self.row_ids[len(self.row_ids) - len(self.new_signatures):]
+        for filename, lines in (('ids.txt', self.new_ids), ('rows.txt', new_rows)):
+            if lines:
+                with open(os.path.join(self.path, filename), 'a', encoding='utf-8') as f:
+                    f.write(''.join(line + '\n' for line in lines))
+
+        meta = {'params': self.params, 'stats': self.stats, 'nb_ids': len(self.ids), 'nb_rows': len(self.row_ids),
+                'nb_chunks': nb_chunks, 'nb_band_keys': self.nb_band_keys,
+                'band_segments': [[number, len(keys)] for number, keys, _ in self.segments],
+                'next_segment': self.next_segment}
+        tmp_filename = self.meta_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(meta, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.meta_filename)
+
+        current_segments = {number for number, _, _ in self.segments}
+        for number in previous_segments:
+            if number not in current_segments:
+                for name in ('band_keys', 'band_rows'):
+                    os.remove(self._segment_filename(name, number))
+
+        self.new_ids = []
+        self.new_signatures = []
+        self.new_bands = {}
@@ -0,0 +1,240 @@
+"""On-disk cache of the count matrices computed by the vectorizer.
+
+An entry is keyed by a fingerprint of the texts, the vectorizer class and
+parameters and the rows it was fitted on / applied to. It is stored in
+<store>/<key>/ as::
+
+    meta.json               -- parameters, shapes and dtypes
+    <matrix>.data.npy       -- CSR buffers of each matrix (ex: train, test)
+    <matrix>.indices.npy
+    <matrix>.indptr.npy
+    vocabulary.txt          -- terms, one per line, in column order
+
+Buffers are saved uncompressed and memory-mapped when read, so an entry
+loads in milliseconds whatever the size of the dataset. The vocabulary is
+only read when a fitted vectorizer has to be rebuilt (final fit, export).
+
+The store is bounded: once it exceeds max_bytes, the least recently used
+entries are removed (the modification time of meta.json is the last use).
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+
+def texts_fingerprint(texts):
+    """SHA-256 of a list of texts, order included
+
+    Arguments:
+        texts {list} -- texts
+
+    Returns:
+        [text] -- hex digest
+    """
+
+    sha = hashlib.sha256()
+    for text in texts:
+        data = text.encode('utf-8')
+        sha.update(np.uint64(len(data)).tobytes())
+        sha.update(data)
+    return sha.hexdigest()
+
+
+def subset_fingerprint(fingerprint, rows):
+    """Fingerprint of some rows of fingerprinted texts, without reading the texts
+
+    Arguments:
+        fingerprint {text}  -- texts_fingerprint of the whole list
+        rows {array}        -- row numbers of the subset, in order
+
+    Returns:
+        [text] -- hex digest
+    """
+
+    sha = hashlib.sha256()
+    sha.update(fingerprint.encode('utf-8'))
+    sha.update(np.asarray(rows, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+
+class FeatureStore(object):
+    """Folder of cached count matrices, safe to share between joblib workers"""
+
+    def __init__(self, path, max_bytes=10 * 2 ** 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def get_key(self, fingerprint, vectorizer, *rows):
+        """Key of the matrices of a vectorizer over some rows of a dataset
+
+        Arguments:
+            fingerprint {text}  -- fingerprint of the texts (see texts_fingerprint)
+            vectorizer {object} -- vectorizer, fitted or not
+            *rows {array}       -- row numbers, the first array being the fitted rows
+
+        Returns:
+            [text] -- hex digest
+        """
+
+        sha = hashlib.sha256()
+        sha.update(fingerprint.encode('utf-8'))
+        sha.update(type(vectorizer).__name__.encode('utf-8'))
+        sha.update(repr(sorted(vectorizer.get_params().items())).encode('utf-8'))
+        for array in rows:
+            sha.update(b'|' + np.asarray(array, dtype=np.int64).tobytes())
+        return sha.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.path, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.get_path(key), 'meta.json'))
+
+    def save(self, key, matrices, vocabulary, params=None):
+        """Store CSR matrices and the vocabulary of their columns
+
+        The entry is written to a temporary folder then renamed, a concurrent
+        writer of the same key loses the race and its copy is dropped.
+
+        Arguments:
+            key {text}          -- entry key
+            matrices {dict}     -- name -> sparse matrix
+            vocabulary {list}   -- term of each column
+
+        Keyword Arguments:
+            params {dict}       -- vectorizer parameters, kept for reference (default: {None})
+        """
+
+        tmp_path = tempfile.mkdtemp(prefix='.' + key[:16], dir=self.path)
+        meta = {'params': {name: repr(value) for name, value in sorted((params or {}).items())},
+                'matrices': {}}
+        for name, matrix in matrices.items():
+            matrix = sparse.csr_matrix(matrix)
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(tmp_path, '%s.%s.npy' % (name, part)), getattr(matrix, part))
+            meta['matrices'][name] = {'shape': list(matrix.shape), 'nnz': int(matrix.nnz)}
+        with open(os.path.join(tmp_path, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocabulary))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+        try:
+            os.rename(tmp_path, self.get_path(key))
+        except OSError:
+            shutil.rmtree(tmp_path)
+        self.evict(keep=key)
+
+    def entries(self):
+        """Stored entries, least recently used first
+
+        Returns:
+            [list] -- (last use, size in bytes, key)
+        """
+
+        entries = []
+        for key in os.listdir(self.path):
+            path = self.get_path(key)
+            try:
+                last_use = os.stat(os.path.join(path, 'meta.json')).st_mtime
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            except OSError:  # temporary folder, or entry removed by another worker
+                continue
+            entries.append((last_use, size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the store fits in max_bytes
+
+        Keyword Arguments:
+            keep {text} -- key never removed (ex: the entry just written) (default: {None})
+        """
+
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(self.get_path(key), ignore_errors=True)
+                total -= size
+
+    def load(self, key):
+        """Memory-map the matrices of an entry
+
+        Arguments:
+            key {text} -- entry key
+
+        Returns:
+            [dict] -- name -> csr_matrix, None if the key is not stored
+        """
+
+        if key not in self:
+            return None
+        path = self.get_path(key)
+        try:
+            os.utime(os.path.join(path, 'meta.json'))  # last use, see evict
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+
+            matrices = {}
+            for name, info in meta['matrices'].items():
+                parts = [np.load(os.path.join(path, '%s.%s.npy' % (name, part)), mmap_mode='r')
+                         for part in ('data', 'indices', 'indptr')]
+                matrices[name] = sparse.csr_matrix(tuple(parts), shape=tuple(info['shape']), copy=False)
+        except OSError:  # evicted by another worker meanwhile
+            return None
+        return matrices
+
+    def load_vocabulary(self, key):
+        with open(os.path.join(self.get_path(key), 'vocabulary.txt'), encoding='utf-8') as f:
+            return f.read().split('\n')
+
+    def vectorize(self, vectorizer, texts, train, test=None, fingerprint=None, restore_vocabulary=True):
+        """Fit a CountVectorizer on some rows and transform them, from the cache when possible
+
+        On a cache hit the vectorizer is not refitted, its vocabulary_ is
+        restored from the entry (unless restore_vocabulary is False) so that it
+        can transform new texts.
+
+        Arguments:
+            vectorizer {CountVectorizer}    -- unfitted vectorizer, fitted in place
+            texts {list}                    -- dataset texts
+            train {array}                   -- rows the vectorizer is fitted on
+
+        Keyword Arguments:
+            test {array}                -- other rows to transform (default: {None})
+            fingerprint {text}          -- texts_fingerprint(texts), computed if None (default: {None})
+            restore_vocabulary {bool}   -- rebuild the fitted vectorizer on a cache hit (default: {True})
+
+        Returns:
+            [tuple] -- (X_train, X_test or None)
+        """
+
+        rows = [train] if test is None else [train, test]
+        key = self.get_key(fingerprint or texts_fingerprint(texts), vectorizer, *rows)
+
+        matrices = self.load(key)
+        if matrices is not None:
+            if restore_vocabulary:
+                vectorizer.vocabulary_ = {term: i for i, term in enumerate(self.load_vocabulary(key))}
+                vectorizer.fixed_vocabulary_ = False
+            return matrices['train'], matrices.get('test')
+
+        matrices = {'train': vectorizer.fit_transform([texts[i] for i in train])}
+        if test is not None:
+            matrices['test'] = vectorizer.transform([texts[i] for i in test])
+
+        vocabulary = np.empty(len(vectorizer.vocabulary_), dtype=object)
+        for term, index in vectorizer.vocabulary_.items():
+            vocabulary[index] = term
+        self.save(key, matrices, vocabulary, vectorizer.get_params())
+        return matrices['train'], matrices.get('test')
@@ -0,0 +1,80 @@
+"""Model loading and prediction shared by the inference scripts."""
+from sklearn.externals import joblib
+
+from compact_model import CompactModel
+from preprocessing import clean_text
+
+
+def get_class_name_from_proba(proba_array, enc):
+    """Get class name from labelencoder
+
+    Arguments:
+        proba_array {array} -- list of propability
+        enc                 -- array with labelencoder's values
+
+    Returns:
+        [string] -- class name
+    """
+    idx = proba_array.flatten().argmax(axis=0)
+    return enc[idx]
+
+
+class Predictor(object):
+    """Fitted estimator and class list, loaded once and reused for every batch"""
+
+    def __init__(self, estimator, class_list, version=None, engine=None):
+        self.estimator = estimator
+        self.class_list = list(class_list)
+        self.version = version
+        self.engine = engine
+
+    @classmethod
+    def load(cls, classlist_filename, estimator_filename):
+        """Load the artefacts written by 3_gridsearch.py
+
+        Arguments:
+            classlist_filename {text}   -- classlist_*.pkl file
+            estimator_filename {text}   -- estimator_*.pkl file
+
+        Returns:
+            [Predictor] -- predictor
+        """
+
+        return cls(joblib.load(estimator_filename), joblib.load(classlist_filename))
+
+    @classmethod
+    def load_compact(cls, path):
+        """Load a model folder written by compact_model.export_compact
+
+        Arguments:
+            path {text} -- compact model folder
+
+        Returns:
+            [Predictor] -- predictor
+        """
+
+        model = CompactModel.load(path)
+        return cls(model, model.class_list)
+
+    def predict(self, texts, clean=True):
+        """Classify a batch of posts with a single predict_proba call
+
+        Arguments:
+            texts {list} -- raw posts
+
+        Keyword Arguments:
+            clean {bool} -- run clean_text first, False if the texts are already clean (default: {True})
+
+        Returns:
+            [list] -- one dict per post: class name and probability of every class
+        """
+
+        if clean:
+            texts = [clean_text(text) for text in texts]
+        if not texts:
+            return []
+
+        probas = self.estimator.predict_proba(texts)
+        return [{'class': get_class_name_from_proba(proba, self.class_list),
+                 'probabilities': dict(zip(self.class_list, proba.tolist()))}
+                for proba in probas]
@@ -0,0 +1,181 @@
+"""Stage timers and counters shared by the scripts.
+
+Code is wrapped in named stages::
+
+    with metrics.stage('fetch'):
+        ...
+    metrics.count('entries', len(entries))
+
+A stage records its number of calls, total duration and the memory
+high-water mark of the process when it last ended. Counters are plain sums
+(entries, bytes read...). Both are exported as JSON or Prometheus text with
+write(). Stages listed in profile_stages also run under cProfile, one .prof
+file per stage is written next to the metrics file. Only stages entered from
+the main thread are profiled: a profiler sees a single thread, and since
+Python 3.12 only one can be active per process, so stages run by worker
+threads (ex: the micro-batcher of 5_serve.py) are timed but not profiled.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_max_rss():
+    """Memory high-water mark of the process in bytes, None if unknown"""
+
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Metrics(object):
+    """Counters and stage timers of a run, safe to update from several threads"""
+
+    def __init__(self, prefix='hn'):
+        self.prefix = prefix
+        self.profile_stages = set()
+        self.counters = {}
+        self.stages = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, profile_stages=()):
+        """Select the stages run under cProfile
+
+        Keyword Arguments:
+            profile_stages {iterable} -- stage names (default: {()})
+        """
+
+        self.profile_stages = set(profile_stages)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as one call of a stage
+
+        Arguments:
+            name {text} -- stage name
+        """
+
+        # cProfile cannot run twice at once, nested stages and other threads are not profiled
+        profile = None
+        if name in self.profile_stages and threading.current_thread() is threading.main_thread() and \
+                not getattr(self._local, 'profiling', False):
+            profile = cProfile.Profile()
+            self._local.profiling = True
+            profile.enable()
+
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            if profile is not None:
+                profile.disable()
+                self._local.profiling = False
+            max_rss = get_max_rss()
+            with self._lock:
+                stats = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_rss_bytes': None})
+                stats['calls'] += 1
+                stats['seconds'] += elapsed
+                stats['max_rss_bytes'] = max_rss
+                if profile is not None:
+                    self._profiles.setdefault(name, []).append(profile)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as a stage
+
+        Arguments:
+            name {text} -- stage name
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'stages': {name: dict(stats) for name, stats in self.stages.items()},
+                    'max_rss_bytes': get_max_rss()}
+
+    def to_prometheus(self):
+        """Prometheus text exposition of the counters and stages
+
+        Returns:
+            [text] -- metrics, one sample per line
+        """
+
+        data = self.to_dict()
+        lines = []
+
+        def add(name, kind, samples):
+            lines.append('# TYPE %s_%s %s' % (self.prefix, name, kind))
+            for labels, value in samples:
+                if value is not None:
+                    lines.append('%s_%s%s %r' % (self.prefix, name, labels, value))
+
+        for name, value in sorted(data['counters'].items()):
+            add(re.sub(r'[^a-zA-Z0-9_]', '_', name) + '_total', 'counter', [('', value)])
+
+        stages = sorted(data['stages'].items())
+        add('stage_calls_total', 'counter', [('{stage="%s"}' % name, s['calls']) for name, s in stages])
+        add('stage_seconds_total', 'counter', [('{stage="%s"}' % name, s['seconds']) for name, s in stages])
+        add('stage_max_rss_bytes', 'gauge', [('{stage="%s"}' % name, s['max_rss_bytes']) for name, s in stages])
+        add('max_rss_bytes', 'gauge', [('', data['max_rss_bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Write the metrics, as Prometheus text for .prom/.txt files, as JSON otherwise
+
+        The cProfile statistics of each profiled stage go to <filename>.<stage>.prof.
+
+        Arguments:
+            filename {text} -- output file, nothing is written if None
+        """
+
+        if not filename:
+            return
+
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if os.path.splitext(filename)[1] in ('.prom', '.txt'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2, sort_keys=True) + '\n'
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(text)
+        os.replace(tmp_filename, filename)
+
+        with self._lock:
+            profiles = dict(self._profiles)
+        for name, stage_profiles in profiles.items():
+            pstats.Stats(*stage_profiles).dump_stats('%s.%s.prof' % (filename, name))
+
+
+# Metrics of the current process
+metrics = Metrics()
@@ -0,0 +1,223 @@
+"""Versioned storage of the trained models.
+
+Every model is saved as one bundle in <registry>/<name>/<version>/::
+
+    bundle.pkl   -- estimator, class list, parameters, metrics, dataset fingerprint, cleaning engine
+    compact/     -- pruned copy of the estimator (see compact_model), if exported
+
+and listed in <registry>/index.json, oldest first. Versions are timestamps
+(as the former estimator_/classlist_ file suffixes). The last predictor loaded
+for each name is cached per process; "latest" is resolved against the index
+on every call, so a long running process picks up a new model without being
+restarted. The cleaning engine of the training dataset is checked against
+the one of the caller when a model is loaded.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+from sklearn.externals import joblib
+
+from compact_model import export_compact, is_exportable
+from inference import Predictor
+
+
+class ModelRegistry(object):
+    """Folder of model bundles with an index of their versions"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_filename = os.path.join(path, 'index.json')
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._index = {'models': {}}
+        self._index_mtime = None
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_filename):
+            return self._index
+        mtime = os.stat(self.index_filename).st_mtime_ns
+        if mtime != self._index_mtime:
+            with open(self.index_filename) as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _save_index(self):
+        tmp_filename = self.index_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self._index, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.index_filename)
+
+    def get_path(self, name, version):
+        return os.path.join(self.path, name, version)
+
+    def versions(self, name):
+        """Index entries of a model, oldest first
+
+        Arguments:
+            name {text} -- model name (ex: cat_main)
+
+        Returns:
+            [list] -- dict with version, created, metrics, fingerprint, params, engine
+        """
+
+        with self._lock:
+            return list(self._read_index()['models'].get(name, []))
+
+    def resolve(self, name, version='latest'):
+        """Turn "latest" into the newest registered version
+
+        Arguments:
+            name {text} -- model name
+
+        Keyword Arguments:
+            version {text} -- version or "latest" (default: {'latest'})
+
+        Returns:
+            [text] -- version
+        """
+
+        versions = [entry['version'] for entry in self.versions(name)]
+        if not versions:
+            raise KeyError("no model registered under " + name)
+        if version == 'latest':
+            return versions[-1]
+        if version not in versions:
+            raise KeyError("unknown version %s of %s" % (version, name))
+        return version
+
+    def save(self, name, estimator, class_list, params=None, metrics=None, fingerprint=None, compact=False,
+             version=None, check_texts=None, engine=None):
+        """Store a model as a new version
+
+        Arguments:
+            name {text}             -- model name (ex: cat_main)
+            estimator {Pipeline}    -- fitted estimator
+            class_list {list}       -- class names, in the order of the encoded labels
+
+        Keyword Arguments:
+            params {dict}       -- training parameters (default: {None})
+            metrics {dict}      -- evaluation scores, JSON serializable (default: {None})
+            fingerprint {text}  -- fingerprint of the training dataset (default: {None})
+            compact {bool}      -- also export the compact model, needs a vocabulary (default: {False})
+            version {text}      -- version, current time if None (default: {None})
+            check_texts {list}  -- clean texts the compact model must score as the estimator does (default: {None})
+            engine {text}       -- cleaning engine of the training dataset, see preprocessing (default: {None})
+
+        Returns:
+            [text] -- version
+        """
+
+        base_version = version = version or time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(self.get_path(name, version)):
+            version = '%s-%d' % (base_version, suffix)
+            suffix += 1
+        path = self.get_path(name, version)
+        os.makedirs(path)
+
+        entry = {'version': version,
+                 'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 'params': {key: repr(value) for key, value in sorted((params or {}).items())},
+                 'metrics': metrics or {},
+                 'fingerprint': fingerprint,
+                 'engine': engine}
+        bundle = dict(entry, name=name, estimator=estimator, class_list=list(class_list), params=params or {})
+        joblib.dump(bundle, os.path.join(path, 'bundle.pkl'), compress=1)
+        if compact:
+            try:
+                export_compact(estimator, class_list, os.path.join(path, 'compact'), check_texts=check_texts)
+            except ValueError:
+                shutil.rmtree(path)
+                raise
+
+        with self._lock:
+            index = self._read_index()
+            index['models'].setdefault(name, []).append(entry)
+            self._save_index()
+        return version
+
+    def import_legacy(self, models_path, name, version):
+        """Register the estimator_/classlist_/best_parameters_ pickles of an older run
+
+        The compact model is exported too when the estimator supports it (see compact_model.is_exportable).
+
+        Arguments:
+            models_path {text}  -- folder of the pickles
+            name {text}         -- model name, also their prefix (ex: cat_main)
+            version {text}      -- their timestamp suffix (ex: 20180423-234137)
+
+        Returns:
+            [text] -- version
+        """
+
+        suffix = name + '_' + version + '.pkl'
+        params_filename = os.path.join(models_path, 'best_parameters_' + suffix)
+        params = joblib.load(params_filename) if os.path.exists(params_filename) else None
+        estimator = joblib.load(os.path.join(models_path, 'estimator_' + suffix))
+        return self.save(name, estimator, joblib.load(os.path.join(models_path, 'classlist_' + suffix)),
+                         params=params, compact=is_exportable(estimator), version=version)
+
+    def load_bundle(self, name, version='latest'):
+        """Read a bundle, not cached
+
+        Arguments:
+            name {text} -- model name
+
+        Keyword Arguments:
+            version {text} -- version or "latest" (default: {'latest'})
+
+        Returns:
+            [dict] -- estimator, class_list, params, metrics, fingerprint, version...
+        """
+
+        return joblib.load(os.path.join(self.get_path(name, self.resolve(name, version)), 'bundle.pkl'))
+
+    def load(self, name, version='latest', compact=False, engine=None):
+        """Predictor of a version, kept until another version of the same name is loaded
+
+        Arguments:
+            name {text} -- model name
+
+        Keyword Arguments:
+            version {text}  -- version or "latest" (default: {'latest'})
+            compact {bool}  -- prefer the compact model when it was exported (default: {False})
+            engine {text}   -- cleaning engine of the texts to score, not checked if None (default: {None})
+
+        Raises:
+            ValueError -- the model was trained on a dataset cleaned with another engine
+
+        Returns:
+            [Predictor] -- predictor, its version and engine attributes are the ones of the bundle
+        """
+
+        version = self.resolve(name, version)
+        trained_engine = next(entry for entry in self.versions(name) if entry['version'] == version).get('engine')
+        if engine is not None and trained_engine is not None and engine != trained_engine:
+            raise ValueError("model %s %s was trained on texts cleaned with engine %r, not %r" % (
+                name, version, trained_engine, engine))
+        key = (version, compact)
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+        compact_path = os.path.join(self.get_path(name, version), 'compact')
+        if compact and os.path.exists(compact_path):
+            predictor = Predictor.load_compact(compact_path)
+        else:
+            bundle = self.load_bundle(name, version)
+            predictor = Predictor(bundle['estimator'], bundle['class_list'])
+        predictor.version = version
+        predictor.engine = trained_engine
+
+        # Only the current predictor of a name is kept, a reload releases the previous one
+        with self._lock:
+            self._cache[name] = (key, predictor)
+        return predictor
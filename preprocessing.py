@@ -0,0 +1,290 @@
+"""Text cleaning shared by the dataset build and the prediction scripts.
+
+TextCleaner builds the punctuation table, the stopword set and the lemmatizer
+once and memoises lemmas, the vocabulary being heavily Zipfian. clean_texts
+fans chunks of documents out to a process pool holding one cleaner per worker.
+
+Two tokenizers are available: 'nltk' (word_tokenize, the reference) and
+'fast', a single regex pass reproducing the word_tokenize splits that survive
+the punctuation and alphabetic filters. A model should be used with the engine
+its dataset was cleaned with.
+
+NLTK is imported on first use only. A lemma table (see save_lemma_table),
+written while building the dataset, holds the stopwords and the lemma of
+every token of the training corpus: a cleaner loaded with it only falls back
+to WordNet for unknown tokens, and never loads the stopwords corpus.
+"""
+import json
+import multiprocessing
+import os
+import re
+import string
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+
+ENGINES = ('nltk', 'fast')
+
+# Text is lower-cased first. Contractions are split off ("don't" -> "do n't",
+# "cannot" -> "can not") and the characters word_tokenize splits on are replaced
+# by a space; any other punctuation is removed by the translate table.
+FAST_TOKEN_RE = re.compile(r"(n't|'(?:s|ll|re|ve|m|d)|(?<=\bcan)not)\b|\.\.\.|--|[,:;@#$%&?!*`(){}\[\]<>\"“”‘’«»–—]")
+
+
+def load_lemma_table(filename):
+    """Load a lemma table
+
+    Arguments:
+        filename {text} -- JSON file written by save_lemma_table
+
+    Returns:
+        [dict] -- 'stop_words': list, 'lemmas': token -> lemma
+    """
+
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_lemma_table(filename, lemmas, stop_words):
+    """Store the lemma table, atomically
+
+    Arguments:
+        filename {text}     -- JSON file
+        lemmas {dict}       -- token -> lemma
+        stop_words {set}    -- stopwords
+    """
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump({'stop_words': sorted(stop_words), 'lemmas': lemmas}, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+class TextCleaner(object):
+    """Clean raw text using different methods :
+       1. tokenize text
+       2. lower text
+       3. remove punctuation
+       4. remove non-alphabetics char
+       5. remove stopwords
+       6. lemmatize
+
+    Lemmas are read from the lemma table, then go through WordNet and a
+    bounded LRU cache keyed on the token, see cache_info() for the hit/miss
+    counters. With engine='fast', steps 1 to 5 are done in a single pass, see
+    clean_fast. NLTK resources are loaded when first needed.
+
+    When new_lemmas is a dict, every token sent to WordNet is recorded in it
+    with its lemma, which is how the lemma table is built.
+    """
+
+    def __init__(self, cache_size=100000, engine='nltk', lemma_table=None):
+        if engine not in ENGINES:
+            raise ValueError("unknown cleaning engine: " + engine)
+        self.engine = engine
+        self.table = str.maketrans('', '', string.punctuation)
+        self.lemmas = {}
+        self._stop_words = None
+        if lemma_table is not None:
+            lemma_table = load_lemma_table(lemma_table)
+            self.lemmas = lemma_table['lemmas']
+            self._stop_words = frozenset(lemma_table['stop_words'])
+        self.new_lemmas = None
+        self._word_tokenize = None
+        self._wordnet = None
+        self._lemmatize = lru_cache(maxsize=cache_size)(self._wordnet_lemmatize)
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            from nltk.corpus import stopwords
+            self._stop_words = frozenset(stopwords.words('english'))
+        return self._stop_words
+
+    def _wordnet_lemmatize(self, word):
+        if self._wordnet is None:
+            from nltk.stem import WordNetLemmatizer
+            self._wordnet = WordNetLemmatizer()
+        lemma = self._wordnet.lemmatize(word)
+        if self.new_lemmas is not None:
+            self.new_lemmas[word] = lemma
+        return lemma
+
+    def lemmatize(self, word):
+        """Lemma of a token, from the lemma table if it is there
+
+        Arguments:
+            word {string} -- lower case token
+
+        Returns:
+            [string] -- lemma
+        """
+
+        return self.lemmas.get(word) or self._lemmatize(word)
+
+    def cache_info(self):
+        """Lemma cache statistics, tokens found in the lemma table are not counted
+
+        Returns:
+            [namedtuple] -- hits, misses, maxsize, currsize
+        """
+
+        return self._lemmatize.cache_info()
+
+    def clean(self, text):
+        """Clean one document
+
+        Arguments:
+            text {string} -- raw text
+
+        Returns:
+            [string] -- clean text
+        """
+
+        if self.engine == 'fast':
+            return self.clean_fast(text)
+
+        if self._word_tokenize is None:
+            from nltk import word_tokenize
+            self._word_tokenize = word_tokenize
+
+        # split into words
+        tokens = self._word_tokenize(text)
+        # convert to lower case
+        tokens = [w.lower() for w in tokens]
+        # remove punctuation from each word
+        stripped = [w.translate(self.table) for w in tokens]
+        # remove remaining tokens that are not alphabetic
+        words = [word for word in stripped if word.isalpha()]
+        # filter out stop words
+        stop_words = self.stop_words
+        words = [w for w in words if not w in stop_words]
+
+        lemmas, lemmatize = self.lemmas, self._lemmatize
+        stemmed = [lemmas.get(word) or lemmatize(word) for word in words]
+
+        return ' '.join(stemmed)
+
+    def clean_fast(self, text):
+        """Clean one document with one regex substitution and one loop over the tokens
+
+        Arguments:
+            text {string} -- raw text
+
+        Returns:
+            [string] -- clean text, same as clean() for nearly every document
+        """
+
+        table, stop_words, lemmas, lemmatize = self.table, self.stop_words, self.lemmas, self._lemmatize
+        words = []
+        for token in FAST_TOKEN_RE.sub(r' \1 ', text.lower()).split():
+            word = token.translate(table)
+            if word.isalpha() and word not in stop_words:
+                words.append(lemmas.get(word) or lemmatize(word))
+        return ' '.join(words)
+
+
+# Cleaner of the current process, created by init_worker or on first use
+_cleaner = None
+
+
+def init_worker(cache_size=100000, engine='nltk', lemma_table=None, record_lemmas=False):
+    """Create the cleaner of the current process
+
+    Keyword Arguments:
+        cache_size {int}        -- size of the lemma cache (default: {100000})
+        engine {text}           -- tokenizer, 'nltk' or 'fast' (default: {'nltk'})
+        lemma_table {text}      -- lemma table file (default: {None})
+        record_lemmas {bool}    -- record the lemmas looked up in WordNet (default: {False})
+    """
+
+    global _cleaner
+    _cleaner = TextCleaner(cache_size, engine, lemma_table)
+    if record_lemmas:
+        _cleaner.new_lemmas = {}
+
+
+def get_cleaner():
+    """Return the cleaner of the current process, creating it if needed
+
+    Returns:
+        [TextCleaner] -- cleaner
+    """
+
+    if _cleaner is None:
+        init_worker()
+    return _cleaner
+
+
+def clean_text(text):
+    """Clean raw text with the cleaner of the current process
+
+    Arguments:
+        text {string} -- raw text
+
+    Returns:
+        [string] -- clean text
+    """
+
+    return get_cleaner().clean(text)
+
+
+def _clean_chunk(chunk):
+    texts = [_cleaner.clean(text) for text in chunk]
+    if _cleaner.new_lemmas is None:
+        return texts, None
+    new_lemmas, _cleaner.new_lemmas = _cleaner.new_lemmas, {}
+    return texts, new_lemmas
+
+
+def clean_texts(texts, n_jobs=None, chunksize=500, cache_size=100000, engine='nltk', lemma_table=None,
+                lemmas=None):
+    """Clean an iterable of raw texts in parallel
+
+    Texts are read lazily and sent to the workers in chunks; at most two chunks
+    per worker are in flight, so memory does not depend on the input size.
+    Results are yielded in input order.
+
+    Arguments:
+        texts {iterable} -- raw texts
+
+    Keyword Arguments:
+        n_jobs {int}        -- number of worker processes, all cores if None (default: {None})
+        chunksize {int}     -- number of texts sent to a worker at once (default: {500})
+        cache_size {int}    -- size of the lemma cache of each worker (default: {100000})
+        engine {text}       -- tokenizer, 'nltk' or 'fast' (default: {'nltk'})
+        lemma_table {text}  -- lemma table file loaded by each worker (default: {None})
+        lemmas {dict}       -- filled with the token -> lemma pairs looked up in WordNet (default: {None})
+
+    Returns:
+        [generator] -- clean texts
+    """
+
+    n_jobs = n_jobs or multiprocessing.cpu_count()
+    texts = iter(texts)
+
+    if n_jobs == 1:
+        # A dedicated cleaner in the current process acts as the only worker
+        cleaner = TextCleaner(cache_size, engine, lemma_table)
+        cleaner.new_lemmas = lemmas
+        for text in texts:
+            yield cleaner.clean(text)
+        return
+
+    def results(result):
+        texts, new_lemmas = result.get()
+        if new_lemmas:
+            lemmas.update(new_lemmas)
+        return texts
+
+    initargs = (cache_size, engine, lemma_table, lemmas is not None)
+    with multiprocessing.Pool(n_jobs, initializer=init_worker, initargs=initargs) as pool:
+        pending = deque()
+        for chunk in iter(lambda: list(islice(texts, chunksize)), []):
+            pending.append(pool.apply_async(_clean_chunk, (chunk,)))
+            if len(pending) >= 2 * n_jobs:
+                for text in results(pending.popleft()):
+                    yield text
+        while pending:
+            for text in results(pending.popleft()):
+                yield text
@@ -0,0 +1,496 @@
+"""Append-only columnar storage for arXiv records.
+
+A store is a folder holding one ``.shard`` file per appended batch (one arXiv
+page for the raw data, one chunk of ChunkWriter for the processed dataset)
+and an ``index.json`` listing the shards in order.
+
+A shard file is laid out as::
+
+    b'HNSHARD1' | header length (uint64) | JSON header | column buffers
+
+Text columns are stored as a single UTF-8 buffer plus int64 offsets, low
+cardinality columns (``cat_main``, ``cat_sub``) as integer codes plus the list
+of categories kept in the header. Buffers are 8-byte aligned so that readers
+can memory-map the file and view each column without copying it.
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+
+import numpy as np
+
+MAGIC = b'HNSHARD1'
+ALIGNMENT = 8
+
+# (column name, kind) - 'str' for free text, 'cat' for dictionary encoded values
+RAW_COLUMNS = (('id', 'str'),
+               ('title', 'str'),
+               ('sum', 'str'),
+               ('cat_main', 'cat'),
+               ('cat_sub', 'cat'))
+
+# Cleaned records written by 2_create_dataset.py
+PROCESSED_COLUMNS = (('id', 'str'),
+                     ('title', 'str'),
+                     ('sum', 'str'),
+                     ('input', 'str'),
+                     ('cat_main', 'cat'),
+                     ('cat_sub', 'cat'))
+
+
+def get_url(arxiv_id):
+    """Rebuild the abstract url which is no longer stored
+
+    Arguments:
+        arxiv_id {text} -- arXiv id (ex: 1804.01234v1)
+
+    Returns:
+        [text] -- url
+    """
+
+    return 'http://arxiv.org/abs/' + arxiv_id
+
+
+def _encode_strings(values):
+    data = [(v or '').encode('utf-8') for v in values]
+    offsets = np.zeros(len(data) + 1, dtype='<i8')
+    np.cumsum(np.array([len(d) for d in data], dtype='<i8'), out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(data), dtype=np.uint8)
+
+
+def _encode_categories(values):
+    categories = sorted(set(values))
+    lookup = {c: i for i, c in enumerate(categories)}
+    dtype = '<u2' if len(categories) < 2 ** 16 else '<u4'
+    return categories, np.array([lookup[v] for v in values], dtype=dtype)
+
+
+def write_shard(filename, records, columns=RAW_COLUMNS):
+    """Write records to a shard file
+
+    Arguments:
+        filename {text} -- shard filename
+        records {list}  -- list of dict, keys not listed in columns are dropped
+
+    Keyword Arguments:
+        columns {tuple} -- (name, kind) of the stored columns (default: {RAW_COLUMNS})
+
+    Returns:
+        [int] -- number of rows written
+    """
+
+    header = {'rows': len(records), 'columns': []}
+    buffers = []
+    position = 0
+
+    def add_buffer(array):
+        nonlocal position
+        buffers.append(array)
+        location = [position, array.nbytes]
+        position += array.nbytes + (-array.nbytes % ALIGNMENT)
+        return location
+
+    for name, kind in columns:
+        values = [r[name] for r in records]
+        column = {'name': name, 'kind': kind}
+        if kind == 'str':
+            offsets, data = _encode_strings(values)
+            column['offsets'] = add_buffer(offsets)
+            column['data'] = add_buffer(data)
+        elif kind == 'cat':
+            categories, codes = _encode_categories(values)
+            column['categories'] = categories
+            column['dtype'] = codes.dtype.str
+            column['codes'] = add_buffer(codes)
+        else:
+            raise ValueError("unknown column kind: " + kind)
+        header['columns'].append(column)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(MAGIC) + 8 + len(header_bytes)) % ALIGNMENT)
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for array in buffers:
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % ALIGNMENT))
+    os.replace(tmp_filename, filename)
+    return len(records)
+
+
+class Shard(object):
+    """Memory-mapped read access to a shard file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+        if self._buffer[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError("not a shard file: " + filename)
+        header_length = int(self._buffer[len(MAGIC):len(MAGIC) + 8].view('<u8')[0])
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._buffer[start:start + header_length].tobytes().decode('utf-8'))
+        self._data_start = start + header_length
+        self.columns = {c['name']: c for c in self.header['columns']}
+
+    def __len__(self):
+        return self.header['rows']
+
+    def _view(self, location, dtype):
+        start = self._data_start + location[0]
+        return self._buffer[start:start + location[1]].view(dtype)
+
+    def codes(self, name):
+        """Integer codes and category list of a 'cat' column, without copy
+
+        Arguments:
+            name {text} -- column name
+
+        Returns:
+            [tuple] -- (codes array, list of categories)
+        """
+
+        column = self.columns[name]
+        return self._view(column['codes'], column['dtype']), column['categories']
+
+    def column(self, name):
+        """Decode a column
+
+        Arguments:
+            name {text} -- column name
+
+        Returns:
+            [list] -- values of the column
+        """
+
+        column = self.columns[name]
+        if column['kind'] == 'cat':
+            codes, categories = self.codes(name)
+            return [categories[c] for c in codes.tolist()]
+
+        offsets = self._view(column['offsets'], '<i8').tolist()
+        data = self._view(column['data'], np.uint8).tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(self))]
+
+    def take(self, name, indices):
+        """Decode some rows of a column
+
+        Arguments:
+            name {text}         -- column name
+            indices {array}     -- row numbers in the shard
+
+        Returns:
+            [list] -- values of the selected rows
+        """
+
+        column = self.columns[name]
+        if column['kind'] == 'cat':
+            codes, categories = self.codes(name)
+            return [categories[c] for c in codes[indices].tolist()]
+
+        offsets = self._view(column['offsets'], '<i8')
+        data = self._view(column['data'], np.uint8)
+        starts = offsets[indices].tolist()
+        ends = offsets[np.asarray(indices) + 1].tolist()
+        return [data[start:end].tobytes().decode('utf-8') for start, end in zip(starts, ends)]
+
+    def records(self, columns=None):
+        """Decode the shard as a list of dict
+
+        Keyword Arguments:
+            columns {list} -- columns to read, all of them if None (default: {None})
+
+        Returns:
+            [list] -- records
+        """
+
+        names = columns or list(self.columns)
+        values = [self.column(name) for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+class ShardStore(object):
+    """Folder of shards with an index keeping their order and row counts.
+
+    Appends may come from several threads (the harvester writes one shard per
+    page); only the index update is serialised.
+    """
+
+    def __init__(self, path, columns=RAW_COLUMNS):
+        self.path = path
+        self.columns = columns
+        self.index_filename = os.path.join(path, 'index.json')
+        self._lock = threading.Lock()
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.index = {'shards': []}
+        if os.path.exists(self.index_filename):
+            with open(self.index_filename) as f:
+                self.index = json.load(f)
+
+    def __len__(self):
+        return sum(s['rows'] for s in self.index['shards'])
+
+    def __contains__(self, name):
+        return any(s['name'] == name for s in self.index['shards'])
+
+    def names(self):
+        return [s['name'] for s in self.index['shards']]
+
+    @property
+    def meta(self):
+        """Free-form metadata of the store (ex: the cleaning engine of a processed dataset)"""
+
+        return dict(self.index.get('meta', {}))
+
+    def set_meta(self, **values):
+        """Update the metadata of the store
+
+        Arguments:
+            **values -- JSON serializable values
+        """
+
+        with self._lock:
+            self.index['meta'] = dict(self.index.get('meta', {}), **values)
+            self._save_index()
+
+    def get_filename(self, name):
+        return os.path.join(self.path, name + '.shard')
+
+    def append(self, name, records, replace=False):
+        """Write records as a new shard
+
+        Arguments:
+            name {text}     -- shard name
+            records {list}  -- list of dict
+
+        Keyword Arguments:
+            replace {bool} -- overwrite a shard with the same name instead of raising (default: {False})
+
+        Raises:
+            ValueError -- a shard with this name exists and replace is False
+
+        Returns:
+            [int] -- number of rows written
+        """
+
+        if not replace and (name in self or os.path.exists(self.get_filename(name))):
+            raise ValueError("shard %s already exists in %s" % (name, self.path))
+        rows = write_shard(self.get_filename(name), records, self.columns)
+        with self._lock:
+            shards = [s for s in self.index['shards'] if s['name'] != name]
+            shards.append({'name': name, 'rows': rows})
+            self.index['shards'] = shards
+            self._save_index()
+        return rows
+
+    def remove(self, name):
+        """Remove one shard of the store
+
+        Arguments:
+            name {text} -- shard name
+        """
+
+        with self._lock:
+            self.index['shards'] = [s for s in self.index['shards'] if s['name'] != name]
+            self._save_index()
+            os.remove(self.get_filename(name))
+
+    def clear(self):
+        """Remove every shard of the store"""
+
+        with self._lock:
+            for name in self.names():
+                os.remove(self.get_filename(name))
+            self.index['shards'] = []
+            self._save_index()
+
+    def _save_index(self):
+        tmp_filename = self.index_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_filename, self.index_filename)
+
+    def import_pickle(self, filename):
+        """Convert a legacy per-page pickle (list of dict) into a shard
+
+        Arguments:
+            filename {text} -- pickle filename, the shard is named after it
+
+        Returns:
+            [int] -- number of rows written
+        """
+
+        with open(filename, 'rb') as f:
+            records = pickle.load(f)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        return self.append(name, records)
+
+    def shard(self, name):
+        return Shard(self.get_filename(name))
+
+    def fingerprint(self):
+        """SHA-256 of the shard names and contents, in index order
+
+        Returns:
+            [text] -- hex digest, identical for identical datasets
+        """
+
+        sha = hashlib.sha256()
+        for name in self.names():
+            sha.update(name.encode('utf-8') + b'\0')
+            with open(self.get_filename(name), 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+        return sha.hexdigest()
+
+    def shards(self):
+        """Iterate over the shards in index order
+
+        Returns:
+            [generator] -- (name, Shard)
+        """
+
+        for name in self.names():
+            yield name, self.shard(name)
+
+    def column(self, name):
+        """Read one column across every shard
+
+        Arguments:
+            name {text} -- column name
+
+        Returns:
+            [list] -- values of the column
+        """
+
+        values = []
+        for _, shard in self.shards():
+            values.extend(shard.column(name))
+        return values
+
+    def category_codes(self, name):
+        """Read a 'cat' column across every shard as integer codes, without decoding strings
+
+        Arguments:
+            name {text} -- column name
+
+        Returns:
+            [tuple] -- (int32 codes of every row, list of categories)
+        """
+
+        categories = []
+        lookup = {}
+        codes = []
+        for _, shard in self.shards():
+            shard_codes, shard_categories = shard.codes(name)
+            for category in shard_categories:
+                if category not in lookup:
+                    lookup[category] = len(categories)
+                    categories.append(category)
+            mapping = np.array([lookup[c] for c in shard_categories], dtype=np.int32)
+            codes.append(mapping[shard_codes] if len(mapping) else np.zeros(0, dtype=np.int32))
+        codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32)
+        return codes, categories
+
+    def take(self, indices, columns=None):
+        """Decode the rows at the given positions of the store
+
+        Only the selected rows are read, shards without any of them are skipped.
+
+        Arguments:
+            indices {array} -- sorted row numbers in the store
+
+        Keyword Arguments:
+            columns {list}  -- columns to read, all of them if None (default: {None})
+
+        Returns:
+            [dict] -- column name -> list of values
+        """
+
+        indices = np.asarray(indices, dtype=np.int64)
+        names = columns or [name for name, _ in self.columns]
+        result = {name: [] for name in names}
+
+        start = 0
+        for shard_info in self.index['shards']:
+            end = start + shard_info['rows']
+            first, last = np.searchsorted(indices, [start, end])
+            if last > first:
+                shard = self.shard(shard_info['name'])
+                for name in names:
+                    result[name].extend(shard.take(name, indices[first:last] - start))
+            start = end
+        return result
+
+    def iter_records(self, columns=None):
+        """Iterate over every record of the store
+
+        Keyword Arguments:
+            columns {list} -- columns to read, all of them if None (default: {None})
+
+        Returns:
+            [generator] -- records
+        """
+
+        for _, shard in self.shards():
+            for record in shard.records(columns):
+                yield record
+
+    def iter_chunks(self, columns=None):
+        """Iterate over the store one shard at a time, column-wise
+
+        Keyword Arguments:
+            columns {list} -- columns to read, all of them if None (default: {None})
+
+        Returns:
+            [generator] -- dict column name -> list of values
+        """
+
+        for _, shard in self.shards():
+            yield {name: shard.column(name) for name in (columns or list(shard.columns))}
+
+
+class ChunkWriter(object):
+    """Buffer records and append them to a store as fixed size shards.
+
+    Shards are named <prefix>_<number>, numbering continues after the largest
+    number already in the store so that a writer can append to an existing
+    dataset, even after some of its chunks were removed.
+    """
+
+    def __init__(self, store, prefix='chunk', chunk_size=10000):
+        self.store = store
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        pattern = re.compile(re.escape(prefix) + r'_(\d+)$')
+        numbers = [int(match.group(1)) for match in map(pattern.match, store.names()) if match]
+        self.nb_chunks = max(numbers) + 1 if numbers else 0
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.store.append('%s_%06d' % (self.prefix, self.nb_chunks), self.buffer)
+            self.nb_chunks += 1
+            self.buffer = []
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,72 @@
+"""Incremental builds of 2_create_dataset.py, run from the repository root:
+
+    python -m pytest tests
+"""
+import random
+
+from benchmarks.utils import WORDS, load_script, synthetic_text
+from dedup import DedupIndex
+from preprocessing import save_lemma_table
+from shard_store import PROCESSED_COLUMNS, ShardStore
+
+create_dataset = load_script('2_create_dataset.py')
+
+
+def make_record(rng, arxiv_id, cat_main, cat_sub):
+    return {'id': arxiv_id, 'title': synthetic_text(rng, 8), 'sum': synthetic_text(rng, 60), 'cat_main': cat_main,
+            'cat_sub': cat_sub}
+
+
+def build(tmp_path, store, processed_shards):
+    # The lemma table holds every word of the records, so neither stop words nor WordNet are needed
+    lemma_table = str(tmp_path / 'lemmas.json')
+    save_lemma_table(lemma_table, {word: word for word in WORDS}, set())
+    dataset = ShardStore(str(tmp_path / 'dataset'), columns=PROCESSED_COLUMNS)
+    index = DedupIndex(str(tmp_path / 'dedup'))
+    create_dataset.build_dataset(store, dataset, index, processed_shards, n_jobs=1, engine='fast',
+                                 lemma_table=lemma_table)
+    return {record['id']: record for record in dataset.iter_records(['id', 'title', 'cat_main'])}
+
+
+def test_changed_shard_replaces_only_its_records(tmp_path):
+    rng = random.Random(0)
+    store = ShardStore(str(tmp_path / 'raw'))
+    store.append('physics_hep-th_0', [make_record(rng, '1801.00000v1', 'Physics', 'hep-th')])
+    store.append('mathematics_math_0', [make_record(rng, '1802.00001v1', 'Mathematics', 'math.CO')])
+    # 1801.00000 is cross-listed and 1802.00001 has a newer version: both stay with the shards read first
+    cs_records = [make_record(rng, '1801.00000v1', 'Computer Science', 'cs.LG'),
+                  make_record(rng, '1802.00001v2', 'Computer Science', 'cs.DM'),
+                  make_record(rng, '1802.00000v1', 'Computer Science', 'cs.LG'),
+                  make_record(rng, '1803.00000v1', 'Computer Science', 'cs.LG')]
+    store.append('computer_science_cs_0', cs_records)
+
+    processed_shards = {}
+    records = build(tmp_path, store, processed_shards)
+    assert sorted(records) == ['1801.00000v1', '1802.00000v1', '1802.00001v1', '1803.00000v1']
+    assert processed_shards['computer_science_cs_0']['ids'] == ['1802.00000', '1803.00000']
+
+    # Edit one record of the cs shard and remove another one
+    cs_records[3]['title'] = 'Model network signal.'
+    del cs_records[2]
+    store.append('computer_science_cs_0', cs_records, replace=True)
+    records = build(tmp_path, store, processed_shards)
+
+    assert sorted(records) == ['1801.00000v1', '1802.00001v1', '1803.00000v1']
+    assert records['1801.00000v1']['cat_main'] == 'Physics'
+    assert records['1802.00001v1']['cat_main'] == 'Mathematics'
+    assert records['1803.00000v1']['title'] == 'model network signal'
+    assert processed_shards['computer_science_cs_0']['ids'] == ['1803.00000']
+
+
+def test_unchanged_shards_are_not_read_again(tmp_path):
+    rng = random.Random(1)
+    store = ShardStore(str(tmp_path / 'raw'))
+    store.append('computer_science_cs_0', [make_record(rng, '1803.00000v1', 'Computer Science', 'cs.LG')])
+
+    processed_shards = {}
+    build(tmp_path, store, processed_shards)
+    state = dict(processed_shards)
+    records = build(tmp_path, store, processed_shards)
+
+    assert list(records) == ['1803.00000v1']
+    assert processed_shards == state
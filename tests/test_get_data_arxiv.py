@@ -0,0 +1,149 @@
+"""Harvester of 1_get_data_arxiv.py against a local server replaying canned Atom pages:
+
+    python -m pytest tests
+"""
+import io
+import json
+import pickle
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from benchmarks.utils import load_script
+from shard_store import ShardStore
+
+arxiv = load_script('1_get_data_arxiv.py')
+
+FEED = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom">%s</feed>')
+ENTRY = ('<entry><id>http://arxiv.org/abs/1804.%05dv1</id><title>Title %d</title><summary>Summary\n%d</summary>'
+         '<arxiv:primary_category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/></entry>')
+
+
+class ArxivStandIn(object):
+    """Serve the entries of one query by pages, failing the requests listed in failures"""
+
+    def __init__(self, nb_entries):
+        self.nb_entries = nb_entries
+        self.failures = {}  # start -> number of 503 answers before the page is served
+        self.retry_after = None  # Retry-After header of the 503 answers
+        self.requests = []
+        self.times = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                start, max_results = int(query['start'][0]), int(query['max_results'][0])
+                stand_in.requests.append((start, query.get('sortBy', [None])[0]))
+                stand_in.times.append(time.monotonic())
+                if stand_in.failures.get(start):
+                    stand_in.failures[start] -= 1
+                    self.send_response(503)
+                    if stand_in.retry_after is not None:
+                        self.send_header('Retry-After', stand_in.retry_after)
+                    self.end_headers()
+                    return
+                ids = range(start, min(start + max_results, stand_in.nb_entries))
+                body = (FEED % ''.join(ENTRY % (i, i, i) for i in ids)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/atom+xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/api/query' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    stand_in = ArxivStandIn(5)
+    yield stand_in
+    stand_in.close()
+
+
+def harvest(server, raw_path, refresh=False, backoff=0):
+    return arxiv.harvest({'cs*': 'Computer Science'}, server.url, str(raw_path), max_results=2, n_workers=1,
+                         min_interval=0, timeout=5, retries=2, backoff=backoff, refresh=refresh)
+
+
+def stored_ids(raw_path):
+    return sorted(record['id'] for record in ShardStore(str(raw_path)).iter_records(['id']))
+
+
+def test_retry_resume_and_rerun(server, tmp_path):
+    # The page at offset 2 fails once (retried), the one at offset 4 on every attempt (given up)
+    server.failures = {2: 1, 4: 2}
+    assert harvest(server, tmp_path) == {'cs*': 4}
+    assert [start for start, _ in server.requests] == [0, 2, 2, 4, 4]
+    assert all(sort_by == 'submittedDate' for _, sort_by in server.requests)
+
+    # The next run resumes at the page given up
+    server.requests = []
+    assert harvest(server, tmp_path) == {'cs*': 1}
+    assert [start for start, _ in server.requests] == [4, 5]
+    assert stored_ids(tmp_path) == ['1804.%05dv1' % i for i in range(5)]
+
+    # A finished query is not requested again
+    server.requests = []
+    assert harvest(server, tmp_path) == {'cs*': 0}
+    assert server.requests == []
+
+
+def test_retries_back_off(server, tmp_path):
+    server.failures = {0: 1}
+    harvest(server, tmp_path, backoff=0.3)
+    assert server.times[1] - server.times[0] >= 0.3
+
+    # Retry-After takes precedence over the backoff
+    server.failures = {5: 1}
+    server.retry_after = '1'
+    server.nb_entries = 6
+    server.times = []
+    harvest(server, tmp_path, refresh=True, backoff=5)
+    assert 1 <= server.times[1] - server.times[0] < 5
+
+
+def test_refresh_fetches_entries_after_a_partial_page(server, tmp_path):
+    harvest(server, tmp_path)
+    with open(str(tmp_path / 'manifest.json')) as f:
+        assert json.load(f) == {'cs*': {'start': 5, 'done': True}}
+
+    server.nb_entries = 8
+    server.requests = []
+    assert harvest(server, tmp_path, refresh=True) == {'cs*': 3}
+    assert [start for start, _ in server.requests] == [5, 7, 8]
+    assert stored_ids(tmp_path) == ['1804.%05dv1' % i for i in range(8)]
+
+
+def test_resume_after_pages_of_the_first_harvester(server, tmp_path):
+    records = [{'id': '1804.%05dv1' % i, 'title': 'Title', 'sum': 'Summary', 'cat_main': 'Computer Science',
+                'cat_sub': 'cs.LG'} for i in range(arxiv.LEGACY_PAGE_SIZE + 3)]
+    ShardStore(str(tmp_path)).append('computer_science_0', records[:arxiv.LEGACY_PAGE_SIZE])
+    with open(str(tmp_path / ('computer_science_%d.p' % arxiv.LEGACY_PAGE_SIZE)), 'wb') as f:
+        pickle.dump(records[arxiv.LEGACY_PAGE_SIZE:], f)
+
+    server.nb_entries = arxiv.LEGACY_PAGE_SIZE + 5
+    assert harvest(server, tmp_path) == {'cs*': 2}
+    assert server.requests[0][0] == arxiv.LEGACY_PAGE_SIZE + 3
+
+
+def test_malformed_entries_are_skipped():
+    feed = FEED % (ENTRY % (0, 0, 0) + '<entry><id>http://arxiv.org/abs/1804.00001v1</id></entry>')
+    skipped = []
+    entries = list(arxiv.iter_entries(io.BytesIO(feed.encode('utf-8')), 'Computer Science', skipped))
+
+    assert [entry['id'] for entry in entries] == ['1804.00000v1']
+    assert [entry['id'] for entry in skipped] == ['1804.00001v1']